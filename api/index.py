@@ -13,6 +13,7 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 import json
 import requests
+from response_cache import ResponseCache
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -23,6 +24,12 @@ OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
 GOOGLE_GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY', '')
 BYTEZ_API_KEY = os.getenv('BYTEZ_API_KEY', '').strip()
 
+# Reused across warm serverless invocations so provider TLS connections stay open
+http_session = requests.Session()
+
+# Pre-serialized, compressed demo payloads with ETags (see backend/response_cache.py)
+response_cache = ResponseCache()
+
 # Model configurations
 OPENROUTER_MODEL = "google/gemini-2.0-flash-exp:free"
 GOOGLE_GEMINI_MODEL = "gemini-2.0-flash-lite"
@@ -69,7 +76,7 @@ def analyze_with_openrouter(text):
     
     for model in FREE_MODELS:
         try:
-            response = requests.post(
+            response = http_session.post(
                 "https://openrouter.ai/api/v1/chat/completions",
                 headers={
                     "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -112,7 +119,7 @@ def analyze_with_gemini(text):
     try:
         url = f"https://generativelanguage.googleapis.com/v1beta/models/{GOOGLE_GEMINI_MODEL}:generateContent?key={GOOGLE_GEMINI_API_KEY}"
         
-        response = requests.post(
+        response = http_session.post(
             url,
             json={
                 "contents": [{"parts": [{"text": f"{SYSTEM_PROMPT}\n\nAnalyze this policy:\n\n{text[:12000]}"}]}],
@@ -144,7 +151,7 @@ def analyze_with_bytez(text):
     
     try:
         import re
-        response = requests.post(
+        response = http_session.post(
             f"https://api.bytez.com/models/v2/{BYTEZ_MODEL}",
             headers={
                 "Authorization": f"Bearer {BYTEZ_API_KEY}",
@@ -209,12 +216,23 @@ def health():
     return jsonify({"status": "healthy", "service": "InsureScan API"})
 
 
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    """Readiness: which AI providers are configured for this deployment"""
+    providers = {
+        "openrouter": bool(OPENROUTER_API_KEY),
+        "gemini": bool(GOOGLE_GEMINI_API_KEY),
+        "bytez": bool(BYTEZ_API_KEY),
+    }
+    return jsonify({"ready": True, "providers": providers})
+
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze():
     """Main analysis endpoint"""
     # Demo mode
     if request.form.get('demo_mode') == 'true':
-        return jsonify(get_mock_analysis())
+        return response_cache.respond('demo', get_mock_analysis)
     
     # Get text from request
     text = request.form.get('text', '')
@@ -251,7 +269,8 @@ def analyze():
 
 @app.route('/api/demo', methods=['GET'])
 def demo():
-    return jsonify(get_mock_analysis())
+    """Demo payload; supports ?fields=a,b and If-None-Match"""
+    return response_cache.respond('demo', get_mock_analysis)
 
 
 # Vercel handler
@@ -5,13 +5,34 @@ Hackathon MVP - Decode complex insurance documents using OCR and LLMs
 
 import os
 import json
+import hashlib
+import hmac
+import itertools
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
 import requests
-from flask import Flask, request, jsonify
+from requests.adapters import HTTPAdapter
+from flask import Flask, Request, request, jsonify, g, has_request_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-from PIL import Image
-import pytesseract
+from werkzeug.middleware.proxy_fix import ProxyFix
+from PIL import Image, ImageSequence
 from dotenv import load_dotenv
+from policy_index import DocumentIndexStore
+from ocr_pool import create_ocr_engine
+from image_dedup import Fingerprint, PerceptualOCRCache
+from single_flight import SingleFlight
+from text_quality import assess_text_quality
+from pdf_engines import create_pdf_engine
+from table_extract import extract_benefit_tables, split_table_blocks
+from response_cache import ResponseCache
+from provider_router import ProviderRouter, OUTCOME_PARSE_FAILURE, OUTCOME_RATE_LIMITED
+from request_profile import (
+    start_profile, stop_profile, current_profile, profile_stage, profiled, cprofile_block, bind_context
+)
 
 # Load environment variables
 load_dotenv()
@@ -22,13 +43,100 @@ CORS(app)  # Enable CORS for all routes
 # Configuration
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), 'uploads')
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
-MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+MAX_CONTENT_LENGTH = int(float(os.getenv('MAX_UPLOAD_MB', '200')) * 1024 * 1024)
+# Only this many pages of a PDF are extracted per request (limit for free
+# tier); use pages=... to pick which ones from a larger document
+MAX_PDF_PAGES = int(os.getenv('MAX_PDF_PAGES', '10'))
+# Uploaded files stream to disk here while the request body is parsed
+UPLOAD_SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, 'spool')
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+os.makedirs(UPLOAD_SPOOL_FOLDER, exist_ok=True)
+
+
+class SpooledRequest(Request):
+    """
+    Streams every uploaded file part straight into its own uniquely named
+    temp file under UPLOAD_SPOOL_FOLDER while the multipart body is parsed
+    (werkzeug reads it in chunks), so large uploads never sit in memory and
+    same-named uploads from different users cannot collide. Extraction reads
+    the spool file in place; it is removed when the request ends.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        suffix = ''
+        if filename and allowed_file(filename):
+            suffix = '.' + filename.rsplit('.', 1)[1].lower()
+        spool = tempfile.NamedTemporaryFile('wb+', dir=UPLOAD_SPOOL_FOLDER, prefix='upload_', suffix=suffix, delete=False)
+        self.__dict__.setdefault('spool_paths', []).append(spool.name)
+        return spool
+
+
+app.request_class = SpooledRequest
+
+
+@app.teardown_request
+def remove_spooled_uploads(exc):
+    """Close and delete the request's spool files"""
+    spool_paths = request.__dict__.get('spool_paths')
+    if not spool_paths:
+        return
+    for _, file in request.files.items(multi=True):
+        file.close()
+    for path in spool_paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+# OCR Configuration
+# Multi-page TIFFs and multi-image uploads are OCR'd frame-by-frame in parallel.
+OCR_MAX_WORKERS = int(os.getenv('OCR_MAX_WORKERS', str(os.cpu_count() or 2)))
+MAX_IMAGE_FRAMES = int(os.getenv('MAX_IMAGE_FRAMES', '40'))
+MAX_UPLOAD_FILES = int(os.getenv('MAX_UPLOAD_FILES', '20'))
+# One core per tesseract process; parallelism comes from running frames side by side
+os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix='ocr')
+# OCR_ENGINE: auto (resident tesserocr pool if installed) | tesserocr | subprocess
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'auto')
+OCR_RECYCLE_AFTER = int(os.getenv('OCR_RECYCLE_AFTER', '500'))
+ocr_engine = create_ocr_engine(OCR_ENGINE, size=OCR_MAX_WORKERS, recycle_after=OCR_RECYCLE_AFTER)
+
+# Re-uploaded pages reuse earlier OCR text from the same client unless the
+# new shot is noticeably sharper; a match must also pass a glyph-level
+# comparison so same-template pages with different details are OCR'd. This
+# catches repeat uploads of an image (re-encoded, shifted, re-exposed), not
+# blurred or rotated re-shots. Off by default. See image_dedup.py.
+OCR_DEDUP_ENABLED = os.getenv('OCR_DEDUP_ENABLED', 'false').lower() == 'true'
+ocr_cache = PerceptualOCRCache(
+    capacity=int(os.getenv('OCR_DEDUP_CAPACITY', '512')),
+    max_distance=int(os.getenv('OCR_DEDUP_MAX_DISTANCE', '32')),
+    sharper_ratio=float(os.getenv('OCR_DEDUP_SHARPER_RATIO', '1.25')),
+) if OCR_DEDUP_ENABLED else None
+
+# PDF text extraction engine: auto | pypdf2 | pypdf | pdfium | pymupdf | pdfminer | poppler
+# Compare the installed ones with `python pdf_engines.py <corpus>` before choosing.
+PDF_ENGINE = os.getenv('PDF_ENGINE', 'auto')
+pdf_engine = create_pdf_engine(PDF_ENGINE)
+
+# Benefit tables (room rent, sub-limits, co-pay by age) are rebuilt from text
+# positions into compact rows when the PDF engine reports layout; see table_extract.py
+TABLE_EXTRACTION_ENABLED = os.getenv('TABLE_EXTRACTION_ENABLED', 'true').lower() == 'true'
+TABLE_MAX_CHARS = int(os.getenv('TABLE_MAX_CHARS', '4000'))
+
+# Mixed PDFs: pages whose text layer scores badly (see text_quality.py) are
+# OCR'd instead, from a rendering of the page when the PDF engine can render
+# (pdfium, pymupdf, poppler), otherwise from its embedded images (the scan itself).
+PDF_PAGE_OCR_ENABLED = os.getenv('PDF_PAGE_OCR_ENABLED', 'true').lower() == 'true'
+PDF_MAX_OCR_PAGES = int(os.getenv('PDF_MAX_OCR_PAGES', '5'))
+PDF_OCR_DPI = int(os.getenv('PDF_OCR_DPI', '200'))
+
+# Admin key for diagnostic features (e.g. /analyze profile=1). Unset = disabled.
+ADMIN_API_KEY = os.getenv('ADMIN_API_KEY', '').strip()
 
 # OpenRouter API Configuration
 OPENROUTER_API_KEY = os.getenv('OPENROUTER_API_KEY', '')
@@ -42,6 +150,411 @@ GOOGLE_GEMINI_MODEL = "gemini-2.0-flash-lite"
 BYTEZ_API_KEY = os.getenv('BYTEZ_API_KEY', '').strip()
 BYTEZ_MODEL = "Qwen/Qwen3-4B"
 
+# OpenRouter free models to try (in order of preference) - updated Jan 2026
+FREE_MODELS = [
+    "google/gemini-2.0-flash-exp:free",
+    "meta-llama/llama-3.3-70b-instruct:free",
+    "deepseek/deepseek-r1:free",
+    "qwen/qwen3-14b:free",
+    "mistralai/mistral-small-3.1-24b-instruct:free",
+]
+
+# Provider routing: attempts are ordered by rolling latency/success stats
+provider_router = ProviderRouter(
+    alpha=float(os.getenv('ROUTER_EWMA_ALPHA', '0.2')),
+    explore=float(os.getenv('ROUTER_EXPLORE', '0.05')),
+    cooldown_seconds=float(os.getenv('ROUTER_COOLDOWN_SECONDS', '60')),
+)
+
+# Shared HTTP session: keeps TLS connections to provider hosts alive and
+# pooled across requests instead of a new handshake per provider call.
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=int(os.getenv('HTTP_POOL_SIZE', '16'))))
+
+PROVIDER_HOSTS = {
+    'openrouter': "https://openrouter.ai/api/v1/models",
+    'gemini': "https://generativelanguage.googleapis.com/",
+    'bytez': "https://api.bytez.com/",
+}
+
+# Follow-up Q&A Configuration
+# Analysed documents are kept as a chunked BM25 index so /ask can send only
+# the top-k matching clauses to the AI provider.
+DOCUMENT_INDEX_FOLDER = os.path.join(UPLOAD_FOLDER, 'index')
+DOCUMENT_INDEX_TTL_HOURS = float(os.getenv('DOCUMENT_INDEX_TTL_HOURS', '24'))
+ASK_TOP_K = int(os.getenv('ASK_TOP_K', '5'))
+ASK_TIMEOUT = float(os.getenv('ASK_TIMEOUT', '15'))
+
+document_store = DocumentIndexStore(
+    DOCUMENT_INDEX_FOLDER, ttl_seconds=int(DOCUMENT_INDEX_TTL_HOURS * 3600)
+)
+
+# Response Cache Configuration
+# Immutable payloads (demo report) are served from pre-serialized,
+# pre-compressed bodies with strong ETags; see response_cache.py.
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', '300'))
+response_cache = ResponseCache(capacity=int(os.getenv('RESPONSE_CACHE_CAPACITY', '256')))
+
+# Single-flight Configuration
+# Identical uploads arriving while one is being analysed wait for that run
+# instead of spending provider quota again. Across gunicorn workers this
+# goes through lock/result files in SINGLE_FLIGHT_FOLDER.
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLE_FLIGHT_FOLDER = os.path.join(UPLOAD_FOLDER, 'inflight')
+SINGLE_FLIGHT_WAIT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_WAIT_TIMEOUT', '240'))
+SINGLE_FLIGHT_RESULT_TTL = float(os.getenv('SINGLE_FLIGHT_RESULT_TTL', '60'))
+
+upload_flights = SingleFlight(
+    SINGLE_FLIGHT_FOLDER,
+    wait_timeout=SINGLE_FLIGHT_WAIT_TIMEOUT,
+    result_ttl=SINGLE_FLIGHT_RESULT_TTL,
+    # Only real AI results are reused (save_and_analyze's real_ai flag); errors and mock data are retried
+    shareable=lambda result: result[2],
+)
+
+# Backpressure Configuration (per worker process)
+# Analyses beyond MAX_INFLIGHT_ANALYSES wait in a bounded queue; when the
+# queue is full (or the wait times out) the request gets a fast 503.
+# Running and queued analyses each hold a gunicorn thread, so inflight +
+# queued (both classes) must stay below WORKER_THREADS or the thread pool
+# fills first and excess requests wait unseen in gunicorn's own queue.
+MAX_INFLIGHT_ANALYSES = int(os.getenv('MAX_INFLIGHT_ANALYSES', '8'))
+MAX_QUEUED_ANALYSES = int(os.getenv('MAX_QUEUED_ANALYSES', '8'))
+QUEUE_WAIT_TIMEOUT = float(os.getenv('QUEUE_WAIT_TIMEOUT', '10'))
+RETRY_AFTER_SECONDS = int(os.getenv('RETRY_AFTER_SECONDS', '15'))
+
+# Batch (bulk) work gets its own queue and may never fill every slot, so
+# interactive single uploads are always scheduled ahead of it.
+MAX_BATCH_INFLIGHT = int(os.getenv('MAX_BATCH_INFLIGHT', str(max(1, MAX_INFLIGHT_ANALYSES // 2))))
+MAX_BATCH_QUEUED = int(os.getenv('MAX_BATCH_QUEUED', '8'))
+BATCH_WAIT_TIMEOUT = float(os.getenv('BATCH_WAIT_TIMEOUT', '60'))
+
+# Follow-up questions (/ask) are short provider calls: they get their own,
+# looser per-client bucket and a small non-queueing concurrency cap instead
+# of waiting behind OCR-heavy analyses
+ASK_RATE_PER_MINUTE = float(os.getenv('ASK_RATE_PER_MINUTE', '30'))
+ASK_BURST = float(os.getenv('ASK_BURST', '10'))
+ASK_MAX_INFLIGHT = int(os.getenv('ASK_MAX_INFLIGHT', '4'))
+
+# Same variable gunicorn.conf.py reads for gthread threads per worker
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', '32'))
+# Threads kept free for /, /demo and /ready; admitted analyses (running or
+# queued) never hold more than what is left after these and /ask's slots
+RESERVED_THREADS = int(os.getenv('RESERVED_THREADS', '4'))
+MAX_ANALYSIS_THREADS = max(1, WORKER_THREADS - RESERVED_THREADS - ASK_MAX_INFLIGHT)
+if MAX_INFLIGHT_ANALYSES + MAX_QUEUED_ANALYSES + MAX_BATCH_QUEUED > MAX_ANALYSIS_THREADS:
+    print(f"⚠️ [BACKPRESSURE] MAX_INFLIGHT_ANALYSES + MAX_QUEUED_ANALYSES + MAX_BATCH_QUEUED "
+          f"should fit in WORKER_THREADS - RESERVED_THREADS - ASK_MAX_INFLIGHT ({MAX_ANALYSIS_THREADS}); "
+          f"analyses are capped there")
+
+# Per-client admission (keyed by a known X-API-Key, else client IP).
+# TRUSTED_PROXY_COUNT is the number of proxies in front of the app (Render: 1);
+# the client IP is the address the outermost of them saw, never a value the
+# client wrote into X-Forwarded-For itself.
+TRUSTED_PROXY_COUNT = int(os.getenv('TRUSTED_PROXY_COUNT', '1'))
+CLIENT_API_KEYS = {
+    hashlib.sha256(key.strip().encode()).hexdigest()[:16]
+    for key in os.getenv('CLIENT_API_KEYS', '').split(',') if key.strip()
+}
+if TRUSTED_PROXY_COUNT > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_COUNT)
+CLIENT_RATE_PER_MINUTE = float(os.getenv('CLIENT_RATE_PER_MINUTE', '10'))
+CLIENT_BURST = float(os.getenv('CLIENT_BURST', '5'))
+# A client with this many analyses already running is treated as bulk work
+CLIENT_INTERACTIVE_INFLIGHT = int(os.getenv('CLIENT_INTERACTIVE_INFLIGHT', '2'))
+
+PRIORITY_INTERACTIVE = 'interactive'
+PRIORITY_BATCH = 'batch'
+
+
+class AnalysisGate:
+    """
+    Global in-flight limit with bounded, prioritised wait queues.
+    Interactive waiters always go before batch waiters, and batch work is
+    capped at max_batch_inflight slots. Works with thread and gevent workers
+    (gevent patches threading).
+    """
+
+    def __init__(self, max_inflight, max_queued, wait_timeout,
+                 max_batch_inflight, max_batch_queued, batch_wait_timeout, max_active=None):
+        self.max_inflight = max_inflight
+        # Cap on running + queued analyses of both classes (threads they may hold)
+        self.max_active = max_active
+        self.limits = {
+            PRIORITY_INTERACTIVE: (max_inflight, max_queued, wait_timeout),
+            PRIORITY_BATCH: (min(max_batch_inflight, max_inflight), max_batch_queued, batch_wait_timeout),
+        }
+        self.inflight = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self.queued = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self.rejected = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 0}
+        self._cond = threading.Condition()
+
+    def _has_slot(self, priority):
+        class_limit = self.limits[priority][0]
+        if sum(self.inflight.values()) >= self.max_inflight:
+            return False
+        if self.inflight[priority] >= class_limit:
+            return False
+        if priority == PRIORITY_BATCH and self.queued[PRIORITY_INTERACTIVE] > 0:
+            return False
+        return True
+
+    def _threads_exhausted(self):
+        if self.max_active is None:
+            return False
+        return sum(self.inflight.values()) + sum(self.queued.values()) >= self.max_active
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE):
+        """Take a slot, waiting in the queue if needed. Returns False when saturated."""
+        _, max_queued, wait_timeout = self.limits[priority]
+        with self._cond:
+            if self._threads_exhausted():
+                self.rejected[priority] += 1
+                return False
+            if self.queued[priority] == 0 and self._has_slot(priority):
+                self.inflight[priority] += 1
+                return True
+            if self.queued[priority] >= max_queued:
+                self.rejected[priority] += 1
+                return False
+            self.queued[priority] += 1
+            deadline = time.monotonic() + wait_timeout
+            try:
+                while True:
+                    # Our own queue entry is counted, so check the slot as if it wasn't
+                    self.queued[priority] -= 1
+                    has_slot = self._has_slot(priority)
+                    self.queued[priority] += 1
+                    if has_slot:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[priority] += 1
+                        return False
+                    self._cond.wait(remaining)
+                self.inflight[priority] += 1
+                return True
+            finally:
+                self.queued[priority] -= 1
+
+    def release(self, priority=PRIORITY_INTERACTIVE):
+        with self._cond:
+            self.inflight[priority] -= 1
+            # Wake everyone: waiters of both classes re-check priority order
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "inflight": dict(self.inflight),
+                "queued": dict(self.queued),
+                "rejected": dict(self.rejected),
+                "max_inflight": self.max_inflight,
+                "max_batch_inflight": self.limits[PRIORITY_BATCH][0],
+                "max_active": self.max_active,
+            }
+
+
+class ClientAdmission:
+    """
+    Per-client token buckets plus per-client active (queued or running) counts.
+    One customer uploading hundreds of scans runs out of tokens (429) and
+    their excess concurrent work is demoted to the batch queue.
+    """
+
+    MAX_TRACKED_CLIENTS = 10000
+
+    def __init__(self, rate_per_minute, burst, interactive_inflight):
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.interactive_inflight = interactive_inflight
+        self.buckets = {}   # client -> (tokens, last_refill)
+        self.inflight = {}  # client -> running analyses
+        self._lock = threading.Lock()
+
+    def try_consume(self, client):
+        """Take one token. Returns (allowed, seconds_until_next_token)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                self.buckets[client] = (tokens - 1, now)
+                allowed, wait = True, 0
+            else:
+                self.buckets[client] = (tokens, now)
+                allowed = False
+                wait = (1 - tokens) / self.rate if self.rate > 0 else RETRY_AFTER_SECONDS
+            if len(self.buckets) > self.MAX_TRACKED_CLIENTS:
+                self._prune(now)
+            return allowed, wait
+
+    def _prune(self, now):
+        """Drop buckets that have refilled completely (idle clients)"""
+        for client, (tokens, last) in list(self.buckets.items()):
+            if tokens + (now - last) * self.rate >= self.burst and not self.inflight.get(client):
+                del self.buckets[client]
+
+    def priority_for(self, client, requested):
+        with self._lock:
+            if requested == PRIORITY_BATCH:
+                return PRIORITY_BATCH
+            if self.inflight.get(client, 0) >= self.interactive_inflight:
+                return PRIORITY_BATCH
+            return PRIORITY_INTERACTIVE
+
+    def started(self, client):
+        """Client has an analysis queued or running"""
+        with self._lock:
+            self.inflight[client] = self.inflight.get(client, 0) + 1
+
+    def finished(self, client):
+        with self._lock:
+            remaining = self.inflight.get(client, 1) - 1
+            if remaining > 0:
+                self.inflight[client] = remaining
+            else:
+                self.inflight.pop(client, None)
+
+
+analysis_gate = AnalysisGate(
+    MAX_INFLIGHT_ANALYSES, MAX_QUEUED_ANALYSES, QUEUE_WAIT_TIMEOUT,
+    MAX_BATCH_INFLIGHT, MAX_BATCH_QUEUED, BATCH_WAIT_TIMEOUT, MAX_ANALYSIS_THREADS
+)
+client_admission = ClientAdmission(CLIENT_RATE_PER_MINUTE, CLIENT_BURST, CLIENT_INTERACTIVE_INFLIGHT)
+ask_admission = ClientAdmission(ASK_RATE_PER_MINUTE, ASK_BURST, ASK_MAX_INFLIGHT)
+ask_slots = threading.BoundedSemaphore(ASK_MAX_INFLIGHT)
+
+
+def get_client_id():
+    """
+    Identify the caller: a known API key (CLIENT_API_KEYS) if sent, else the
+    client IP as seen by the trusted proxy (remote_addr, set by ProxyFix).
+    Unknown keys and client-written X-Forwarded-For entries are ignored, so
+    changing them cannot buy a fresh token bucket.
+    """
+    api_key = request.headers.get('X-API-Key', '').strip()
+    if api_key:
+        # Never keep raw keys in memory maps or logs
+        key_id = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+        if key_id in CLIENT_API_KEYS:
+            return f"key:{key_id}"
+    return f"ip:{request.remote_addr}"
+
+
+def get_requested_priority():
+    """Clients mark bulk jobs with ?priority=batch or an X-Priority header (read before the body)"""
+    requested = request.args.get('priority') or request.headers.get('X-Priority', '')
+    return PRIORITY_BATCH if requested.strip().lower() == PRIORITY_BATCH else PRIORITY_INTERACTIVE
+
+
+def server_busy_response(status_code=503, retry_after=RETRY_AFTER_SECONDS, message=None):
+    """503/429 with Retry-After so clients back off instead of piling up connections"""
+    retry_after = max(1, int(round(retry_after)))
+    response = jsonify({
+        "error": message or "Server is busy analyzing other policies. Please retry shortly.",
+        "retry_after": retry_after
+    })
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+# Endpoints admitted through analysis_gate (see with_backpressure)
+GATED_ENDPOINTS = set()
+# Demo-mode posts carry one small form field and no file, so only bodies this
+# small are parsed before admission to look for demo_mode
+DEMO_BODY_MAX_BYTES = 64 * 1024
+
+
+def with_backpressure(view):
+    """
+    Route decorator: admit the request through the per-client rate limit and
+    analysis_gate before the view runs, or fail fast with 429/503. Admission
+    happens in admit_gated_request, before the multipart body is parsed, so
+    a rejected upload is never spooled to disk.
+    """
+    GATED_ENDPOINTS.add(view.__name__)
+    return view
+
+
+def is_demo_request():
+    if request.args.get('demo_mode') == 'true':
+        return True
+    length = request.content_length
+    return length is not None and length <= DEMO_BODY_MAX_BYTES and request.form.get('demo_mode') == 'true'
+
+
+@app.before_request
+def admit_gated_request():
+    """Per-client rate limit, then a slot in analysis_gate, using request headers only"""
+    # CORS preflights carry no work; flask_cors answers them
+    if request.method == 'OPTIONS' or request.endpoint not in GATED_ENDPOINTS or is_demo_request():
+        return None
+    client = get_client_id()
+    allowed, wait = client_admission.try_consume(client)
+    if not allowed:
+        print(f"🚦 [ADMISSION] Rate limit hit for {client}, retry in {wait:.0f}s")
+        return server_busy_response(
+            429, wait, "Too many analyses from this client. Please slow down and retry shortly."
+        )
+
+    # Count queued work too, so a client firing many uploads at once is demoted
+    priority = client_admission.priority_for(client, get_requested_priority())
+    client_admission.started(client)
+    if not analysis_gate.acquire(priority):
+        client_admission.finished(client)
+        print(f"🚦 [BACKPRESSURE] Saturated ({analysis_gate.stats()}), rejecting {priority} request")
+        return server_busy_response()
+    g.admission = (client, priority)
+    return None
+
+
+@app.teardown_request
+def release_admission(exc):
+    admission = g.pop('admission', None)
+    if admission is not None:
+        client, priority = admission
+        client_admission.finished(client)
+        analysis_gate.release(priority)
+
+
+def with_ask_limit(view):
+    """
+    Route decorator for /ask: the client's follow-up question bucket, then
+    one of ASK_MAX_INFLIGHT slots; fails fast with 429/503, never queues.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        client = get_client_id()
+        allowed, wait = ask_admission.try_consume(client)
+        if not allowed:
+            print(f"🚦 [ADMISSION] Question rate limit hit for {client}, retry in {wait:.0f}s")
+            return server_busy_response(
+                429, wait, "Too many questions from this client. Please slow down and retry shortly."
+            )
+        if not ask_slots.acquire(blocking=False):
+            print(f"🚦 [BACKPRESSURE] All {ASK_MAX_INFLIGHT} question slots busy, rejecting")
+            return server_busy_response(503, 2, "Server is busy answering other questions. Please retry shortly.")
+        try:
+            return view(*args, **kwargs)
+        finally:
+            ask_slots.release()
+    return wrapper
+
+
+# Pipelined extraction/analysis: when extraction is slow (OCR'd scans, long
+# PDFs), the main AI request starts once the first pages hold enough
+# important sections; later pages get a second pass whose list findings are
+# merged in. The main scores then only see the early pages, so this is off by
+# default and never kicks in before PIPELINE_SLOW_SECONDS of extraction.
+PIPELINE_ENABLED = os.getenv('PIPELINE_ENABLED', 'false').lower() == 'true'
+PIPELINE_SLOW_SECONDS = float(os.getenv('PIPELINE_SLOW_SECONDS', '5'))
+PIPELINE_START_CHARS = int(os.getenv('PIPELINE_START_CHARS', '6000'))
+PIPELINE_MIN_SECTIONS = int(os.getenv('PIPELINE_MIN_SECTIONS', '20'))
+PIPELINE_LATE_MAX_CHARS = int(os.getenv('PIPELINE_LATE_MAX_CHARS', '12000'))
+analysis_executor = ThreadPoolExecutor(max_workers=MAX_INFLIGHT_ANALYSES * 2, thread_name_prefix='analysis')
+
 
 # Enhanced AI System Prompt for Smart Policy Report
 SYSTEM_PROMPT = """You are InsureScan AI, an expert insurance policy analyst specializing in Indian insurance policies (health, life, motor, travel).
@@ -141,69 +654,297 @@ def clean_extracted_text(text):
     return cleaned
 
 
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF using PyPDF2 (memory-efficient for free tier)"""
+def parse_page_ranges(spec):
+    """
+    Parse a 1-based page selection like "1-5,8,20-" into [(start, end), ...]
+    (end None = to the last page). Raises ValueError on malformed input.
+    """
+    ranges = []
+    for part in spec.replace(' ', '').split(','):
+        if not part:
+            continue
+        start, dash, end = part.partition('-')
+        if not start.isdigit() or (end and not end.isdigit()):
+            raise ValueError(f"'{part}' is not a page or page range")
+        start = int(start)
+        end = (int(end) if end else None) if dash else start
+        if start < 1 or (end is not None and end < start):
+            raise ValueError(f"'{part}' is not a valid page range")
+        ranges.append((start, end))
+    if not ranges:
+        raise ValueError("no pages given")
+    if len(ranges) > 50:
+        raise ValueError("too many page ranges")
+    return ranges
+
+
+def format_page_ranges(pages):
+    """Inverse of parse_page_ranges, for echoing the selection back"""
+    return ",".join(str(start) if start == end else f"{start}-{end or ''}" for start, end in pages)
+
+
+class PageSelectionError(ValueError):
+    """A `pages` selection that matches no page of the document"""
+
+    def __init__(self, pages, total_pages):
+        super().__init__(
+            f"Page selection {format_page_ranges(pages)} is outside the document: it has {total_pages} page(s)"
+        )
+        self.total_pages = total_pages
+
+
+def select_page_indices(total_pages, pages=None, limit=None):
+    """0-based page indices to process: the requested pages (all if None) that exist, in order, up to limit"""
+    if pages is None:
+        indices = range(total_pages)
+    else:
+        wanted = set()
+        for start, end in pages:
+            wanted.update(range(start - 1, min(end or total_pages, total_pages)))
+        indices = sorted(wanted)
+    return list(itertools.islice(indices, limit))
+
+
+def iter_pdf_pages(file_path, pages=None):
+    """
+    Yield the text of each PDF page in order using the configured PDF engine
+    (PDF_ENGINE, see pdf_engines.py).
+    Only `pages` (see parse_page_ranges) are read when given, at most MAX_PDF_PAGES.
+    Pages with a missing or garbled text layer are OCR'd instead.
+    """
     import gc
-    from PyPDF2 import PdfReader
     
-    print(f"\n📄 [PDF EXTRACTION] Starting extraction from: {file_path}")
-    text_parts = []
-    MAX_PAGES = 10  # Limit pages for free tier
+    print(f"\n📄 [PDF EXTRACTION] Starting extraction from: {file_path} ({pdf_engine.name})")
     
     try:
-        reader = PdfReader(file_path)
-        total_pages = len(reader.pages)
-        pages_to_process = min(total_pages, MAX_PAGES)
-        print(f"📄 [PDF EXTRACTION] Found {total_pages} pages, processing first {pages_to_process}")
+        document = pdf_engine.open(file_path)
+    except Exception as e:
+        print(f"❌ [PDF EXTRACTION] Error: {e}")
+        raise Exception(f"Failed to extract text from PDF: {str(e)}")
+    
+    try:
+        total_pages = document.page_count
+        page_indices = select_page_indices(total_pages, pages, MAX_PDF_PAGES)
+        if pages is not None and not page_indices:
+            raise PageSelectionError(pages, total_pages)
+        if pages is None:
+            print(f"📄 [PDF EXTRACTION] Found {total_pages} pages, processing first {len(page_indices)}")
+        else:
+            print(f"📄 [PDF EXTRACTION] Found {total_pages} pages, processing {len(page_indices)} requested ({format_page_ranges(pages)})")
         
-        for i in range(pages_to_process):
+        ocr_pages = 0
+        table_count = 0
+        for i in page_indices:
             try:
-                page = reader.pages[i]
-                page_text = page.extract_text()
-                if page_text:
-                    text_parts.append(page_text)
-                    print(f"📄 [PDF EXTRACTION] Page {i+1}: Extracted {len(page_text)} characters")
-                else:
-                    print(f"📄 [PDF EXTRACTION] Page {i+1}: No text found")
+                page_text = fragments = None
+                if TABLE_EXTRACTION_ENABLED:
+                    try:
+                        page_text, fragments = document.page_layout(i)
+                    except Exception as layout_error:
+                        # Losing the layout only costs the table stage, not the page
+                        print(f"📄 [PDF EXTRACTION] Page {i+1}: layout failed ({layout_error}), using plain text")
+                if page_text is None:
+                    page_text = document.page_text(i)
+                # Scanned or garbled page: OCR it instead (capped per document)
+                quality = assess_text_quality(page_text)
+                if not quality.ok and PDF_PAGE_OCR_ENABLED and ocr_pages < PDF_MAX_OCR_PAGES:
+                    ocr_text = ocr_pdf_page(document, i, quality)
+                    if ocr_text is not None:
+                        ocr_pages += 1
+                        if assess_text_quality(ocr_text).score > quality.score:
+                            page_text, fragments = ocr_text, None
+                # Benefit tables: replace their flattened lines with compact rows
+                # whenever the text layer is kept (OCR output has no layout)
+                if fragments is not None:
+                    try:
+                        with profile_stage('tables', page=i + 1) as stage:
+                            page_text, found = extract_benefit_tables(page_text, fragments, i + 1)
+                            stage['tables'] = found
+                        table_count += found
+                    except Exception as table_error:
+                        print(f"📄 [PDF EXTRACTION] Page {i+1}: table extraction failed ({table_error}), keeping page text")
                 # Force garbage collection
                 gc.collect()
             except Exception as page_error:
                 print(f"📄 [PDF EXTRACTION] Page {i+1}: Error - {page_error}")
                 continue
+            if page_text:
+                print(f"📄 [PDF EXTRACTION] Page {i+1}: Extracted {len(page_text)} characters")
+                yield page_text
+            else:
+                print(f"📄 [PDF EXTRACTION] Page {i+1}: No text found")
                 
-        if total_pages > MAX_PAGES:
-            print(f"⚠️ [PDF EXTRACTION] Skipped {total_pages - MAX_PAGES} pages to save memory")
+        if ocr_pages:
+            print(f"📄 [PDF EXTRACTION] OCR'd {ocr_pages} page(s) with a bad text layer")
+        if table_count:
+            print(f"📄 [PDF EXTRACTION] Extracted {table_count} benefit table(s)")
+        if len(select_page_indices(total_pages, pages)) > MAX_PDF_PAGES:
+            print(f"⚠️ [PDF EXTRACTION] Stopped at MAX_PDF_PAGES={MAX_PDF_PAGES} pages to save memory")
             
+    except PageSelectionError:
+        raise
     except Exception as e:
         print(f"❌ [PDF EXTRACTION] Error: {e}")
         raise Exception(f"Failed to extract text from PDF: {str(e)}")
-    
-    # Join text parts
-    text = "\n".join(text_parts)
-    
-    # Clean the extracted text
-    text = clean_extracted_text(text)
-    
-    print(f"📄 [PDF EXTRACTION] Total extracted: {len(text)} characters")
-    print(f"📄 [PDF EXTRACTION] First 500 chars: {text[:500]}")
-    return text.strip()
+    finally:
+        document.close()
 
 
-def extract_text_from_image(file_path):
-    """Extract text from image using pytesseract OCR"""
-    print(f"\n🖼️ [IMAGE OCR] Starting OCR on: {file_path}")
-    try:
-        image = Image.open(file_path)
-        print(f"🖼️ [IMAGE OCR] Image size: {image.size}")
-        text = pytesseract.image_to_string(image, lang='eng')
-        print(f"🖼️ [IMAGE OCR] Extracted {len(text)} characters")
-        print(f"🖼️ [IMAGE OCR] First 500 chars: {text[:500]}")
-    except Exception as e:
-        print(f"❌ [IMAGE OCR] Error: {e}")
-        raise Exception(f"Failed to extract text from image: {str(e)}")
-    return text.strip()
+def ocr_pdf_page(document, index, quality):
+    """
+    OCR one PDF page whose text layer failed the quality check, using the
+    images the PDF engine gives for it (see pdf_engines.page_images). None
+    if there is nothing to OCR.
+    """
+    images = document.page_images(index, PDF_OCR_DPI)
+    if not images:
+        return None
+    print(f"📄 [PDF EXTRACTION] Page {index+1}: text layer failed {quality.reasons}, OCR'ing {len(images)} image(s)")
+    with profile_stage('pdf_page_ocr', page=index + 1, reasons=quality.reasons) as stage:
+        text = "\n".join(part.strip() for part in ocr_frames(images) if part.strip())
+        stage['chars_out'] = len(text)
+    return text
+
+
+def load_image_frames(file_path, pages=None):
+    """
+    Load the frames of an image (multi-page TIFF / animated GIF), up to MAX_IMAGE_FRAMES.
+    With `pages`, only those frames are decoded.
+    """
+    with Image.open(file_path) as image:
+        total_frames = getattr(image, 'n_frames', 1)
+        if pages is None:
+            frames = [frame.copy() for frame in itertools.islice(ImageSequence.Iterator(image), MAX_IMAGE_FRAMES)]
+            skipped = total_frames - len(frames)
+        else:
+            wanted = select_page_indices(total_frames, pages)
+            if not wanted:
+                raise PageSelectionError(pages, total_frames)
+            frames = []
+            for index in wanted[:MAX_IMAGE_FRAMES]:
+                image.seek(index)
+                frames.append(image.copy())
+            skipped = len(wanted) - len(frames)
+    if skipped > 0:
+        print(f"⚠️ [IMAGE OCR] Skipped {skipped} frames (MAX_IMAGE_FRAMES={MAX_IMAGE_FRAMES})")
+    return frames
+
+
+def ocr_frame(frame):
+    """OCR a single frame/page on the configured engine (resident pool or subprocess)"""
+    return ocr_engine.image_to_string(frame)
+
+
+def iter_ocr_frames(frames):
+    """
+    OCR frames in parallel and yield their texts in the original order.
+    Tesseract runs outside the GIL (own process or tesserocr), so the shared
+    thread pool spreads frames across cores while capping OCR per worker.
+    Near-duplicates of frames this client recently OCR'd reuse the earlier text.
+    """
+    texts = [None] * len(frames)
+    fingerprints = [None] * len(frames)
+    # OCR text is only ever reused for the client that uploaded the original
+    scope = get_client_id() if has_request_context() else None
+    if ocr_cache is not None:
+        for i, frame in enumerate(frames):
+            fingerprints[i] = Fingerprint(frame)
+            texts[i] = ocr_cache.lookup(fingerprints[i], scope)
+        reused = sum(text is not None for text in texts)
+        if reused:
+            print(f"♻️ [IMAGE OCR] Reusing OCR text for {reused} near-duplicate frame(s)")
+
+    pending = [i for i, text in enumerate(texts) if text is None]
+    if len(pending) == 1:
+        results = (ocr_frame(frames[i]) for i in pending)
+    else:
+        # map() submits every frame now and hands results back in order
+        results = ocr_executor.map(ocr_frame, [frames[i] for i in pending])
+
+    for i in range(len(frames)):
+        if texts[i] is None:
+            texts[i] = next(results)
+            if ocr_cache is not None:
+                ocr_cache.store(fingerprints[i], texts[i], scope)
+        yield texts[i]
 
 
+def ocr_frames(frames):
+    """OCR frames in parallel and return their texts in the original order"""
+    return list(iter_ocr_frames(frames))
+
+
+def extract_text_from_files(file_paths, pages=None):
+    """
+    Extract text from one or more uploaded files, keeping upload order.
+    All image frames across the upload are OCR'd together in parallel.
+    """
+    text = clean_extracted_text("\n".join(iter_document_pages(file_paths, pages))).strip()
+    print(f"📝 [TEXT] Extracted {len(text)} characters from {len(file_paths)} file(s)")
+    return text
+
+
+# Keywords that indicate important sections
+IMPORTANT_KEYWORDS = [
+    # Red flag indicators
+    'room rent', 'sub-limit', 'sublimit', 'co-pay', 'copay', 'co-payment',
+    'waiting period', 'pre-existing', 'preexisting', 'exclusion',
+    'not covered', 'not payable', 'limitation', 'cap', 'maximum limit',
+    'deductible', 'proportionate', 'proportional deduction',
+    # Good feature indicators  
+    'no claim bonus', 'ncb', 'restoration', 'reinstatement',
+    'cashless', 'network hospital', 'day care', 'domiciliary',
+    'pre-hospitalization', 'post-hospitalization', 'ambulance',
+    'health checkup', 'wellness', 'maternity', 'newborn',
+    # Coverage terms
+    'sum insured', 'coverage', 'benefit', 'claim', 'premium',
+    'hospitalization', 'treatment', 'surgery', 'icu', 'critical illness'
+]
+
+
+def iter_document_pages(file_paths, pages=None):
+    """
+    Yield page texts of an upload in order (PDF pages, image frames) as soon
+    as each is ready. All image frames are queued for OCR up front so they
+    are recognised in parallel while earlier pages are being consumed.
+    """
+    image_frame_counts = {}
+    all_frames = []
+    for file_path in file_paths:
+        if file_path.rsplit('.', 1)[1].lower() != 'pdf':
+            try:
+                frames = load_image_frames(file_path, pages)
+            except PageSelectionError:
+                raise
+            except Exception as e:
+                print(f"❌ [IMAGE OCR] Error: {e}")
+                raise Exception(f"Failed to extract text from image: {str(e)}")
+            print(f"🖼️ [IMAGE OCR] {os.path.basename(file_path)}: {len(frames)} frame(s), size {frames[0].size if frames else None}")
+            image_frame_counts[file_path] = len(frames)
+            all_frames.extend(frames)
+    ocr_results = iter_ocr_frames(all_frames)
+
+    for file_path in file_paths:
+        if file_path in image_frame_counts:
+            try:
+                for _ in range(image_frame_counts[file_path]):
+                    frame_text = next(ocr_results).strip()
+                    if frame_text:
+                        yield frame_text
+            except Exception as e:
+                print(f"❌ [IMAGE OCR] Error: {e}")
+                raise Exception(f"Failed to extract text from image: {str(e)}")
+        else:
+            yield from iter_pdf_pages(file_path, pages)
+
+
+def score_paragraph(para):
+    """Number of important insurance keywords found in a paragraph"""
+    para_lower = para.lower()
+    return sum(1 for keyword in IMPORTANT_KEYWORDS if keyword in para_lower)
+
+
+@profiled('section_selection')
 def extract_important_sections(text, max_chars=12000):
     """
     Extract the most important sections from a large insurance document.
@@ -211,22 +952,9 @@ def extract_important_sections(text, max_chars=12000):
     """
     print(f"\n📋 [SMART EXTRACT] Processing {len(text)} characters...")
     
-    # Keywords that indicate important sections
-    important_keywords = [
-        # Red flag indicators
-        'room rent', 'sub-limit', 'sublimit', 'co-pay', 'copay', 'co-payment',
-        'waiting period', 'pre-existing', 'preexisting', 'exclusion',
-        'not covered', 'not payable', 'limitation', 'cap', 'maximum limit',
-        'deductible', 'proportionate', 'proportional deduction',
-        # Good feature indicators  
-        'no claim bonus', 'ncb', 'restoration', 'reinstatement',
-        'cashless', 'network hospital', 'day care', 'domiciliary',
-        'pre-hospitalization', 'post-hospitalization', 'ambulance',
-        'health checkup', 'wellness', 'maternity', 'newborn',
-        # Coverage terms
-        'sum insured', 'coverage', 'benefit', 'claim', 'premium',
-        'hospitalization', 'treatment', 'surgery', 'icu', 'critical illness'
-    ]
+    # Benefit tables are already compact and hold the key limits: keep them
+    # whole, ahead of the scored paragraphs (up to TABLE_MAX_CHARS)
+    tables, text = split_table_blocks(text)
     
     # Split text into paragraphs
     paragraphs = text.split('\n')
@@ -234,11 +962,7 @@ def extract_important_sections(text, max_chars=12000):
     # Score each paragraph based on keyword matches
     scored_paragraphs = []
     for i, para in enumerate(paragraphs):
-        para_lower = para.lower()
-        score = 0
-        for keyword in important_keywords:
-            if keyword in para_lower:
-                score += 1
+        score = score_paragraph(para)
         if score > 0 and len(para.strip()) > 30:  # Must have some content
             scored_paragraphs.append((score, i, para))
     
@@ -254,6 +978,14 @@ def extract_important_sections(text, max_chars=12000):
     extracted.append("=== POLICY INTRODUCTION ===\n" + intro)
     total_chars += len(intro)
     
+    table_chars = 0
+    for table in tables:
+        if table_chars + len(table) > min(TABLE_MAX_CHARS, max_chars - total_chars):
+            break
+        extracted.append(table)
+        table_chars += len(table)
+    total_chars += table_chars
+    
     # Add high-scoring paragraphs
     used_indices = set()
     for score, idx, para in scored_paragraphs:
@@ -276,26 +1008,17 @@ def extract_important_sections(text, max_chars=12000):
                 used_indices.add(idx + 1)
     
     result = "\n\n".join(extracted)
-    print(f"📋 [SMART EXTRACT] Extracted {len(result)} chars from {len(scored_paragraphs)} important paragraphs")
+    print(f"📋 [SMART EXTRACT] Extracted {len(result)} chars from {len(scored_paragraphs)} important paragraphs and {len(tables)} table(s)")
     
     return result[:max_chars]
 
 
-def analyze_with_openrouter(text, retry_count=0):
-    """Analyze policy text using OpenRouter API with multiple model fallbacks"""
-    
-    # List of free models to try (in order of preference) - updated Jan 2026
-    FREE_MODELS = [
-        "google/gemini-2.0-flash-exp:free",
-        "meta-llama/llama-3.3-70b-instruct:free",
-        "deepseek/deepseek-r1:free",
-        "qwen/qwen3-14b:free",
-        "mistralai/mistral-small-3.1-24b-instruct:free",
-    ]
-    
-    model = FREE_MODELS[min(retry_count, len(FREE_MODELS) - 1)]
-    
-    print(f"\n🤖 [OPENROUTER] Starting AI analysis (attempt {retry_count + 1})...")
+def analyze_with_openrouter(text, model=OPENROUTER_MODEL, system_prompt=SYSTEM_PROMPT):
+    """
+    Analyze policy text with one OpenRouter model.
+    analyze_policy decides which of FREE_MODELS to try and in what order.
+    """
+    print(f"\n🤖 [OPENROUTER] Starting AI analysis...")
     print(f"🤖 [OPENROUTER] Text length to analyze: {len(text)} characters")
     print(f"🤖 [OPENROUTER] Using model: {model}")
     print(f"🤖 [OPENROUTER] API Key present: {bool(OPENROUTER_API_KEY)}")
@@ -313,7 +1036,7 @@ def analyze_with_openrouter(text, retry_count=0):
         payload = {
             "model": model,
             "messages": [
-                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": f"Analyze this insurance policy:\n\n{text_to_analyze}"}
             ],
             "temperature": 0.3,
@@ -322,7 +1045,7 @@ def analyze_with_openrouter(text, retry_count=0):
         
         print(f"🤖 [OPENROUTER] Sending request to API...")
         
-        response = requests.post(
+        response = http_session.post(
             url="https://openrouter.ai/api/v1/chat/completions",
             headers={
                 "Authorization": f"Bearer {OPENROUTER_API_KEY}",
@@ -336,23 +1059,15 @@ def analyze_with_openrouter(text, retry_count=0):
         
         print(f"🤖 [OPENROUTER] Response status: {response.status_code}")
         
-        # Handle rate limiting - try next model
+        # Rate limited - the router cools this model down and moves on
         if response.status_code == 429:
-            print(f"⚠️ [OPENROUTER] Rate limited! Trying next model...")
-            if retry_count < len(FREE_MODELS) - 1:
-                import time
-                time.sleep(1)  # Brief pause before retry
-                return analyze_with_openrouter(text, retry_count + 1)
-            else:
-                print(f"❌ [OPENROUTER] All models rate limited!")
-                return None
+            print(f"⚠️ [OPENROUTER] Rate limited on {model}!")
+            provider_router.note(OUTCOME_RATE_LIMITED)
+            return None
         
         if response.status_code != 200:
             print(f"❌ [OPENROUTER] API error: {response.status_code}")
             print(f"❌ [OPENROUTER] Response body: {response.text}")
-            # Try next model on error
-            if retry_count < len(FREE_MODELS) - 1:
-                return analyze_with_openrouter(text, retry_count + 1)
             return None
         
         result = response.json()
@@ -382,6 +1097,7 @@ def analyze_with_openrouter(text, retry_count=0):
         return parsed_result
         
     except json.JSONDecodeError as e:
+        provider_router.note(OUTCOME_PARSE_FAILURE)
         print(f"❌ [OPENROUTER] JSON parse error: {e}")
         print(f"❌ [OPENROUTER] Raw text that failed to parse: {result_text}")
         return None
@@ -393,7 +1109,7 @@ def analyze_with_openrouter(text, retry_count=0):
         return None
 
 
-def analyze_with_gemini(text):
+def analyze_with_gemini(text, model=GOOGLE_GEMINI_MODEL, system_prompt=SYSTEM_PROMPT):
     """
     Analyze policy text using Google Gemini API (fallback when OpenRouter is rate limited).
     Uses the Gemini REST API directly.
@@ -416,7 +1132,7 @@ def analyze_with_gemini(text):
         print(f"🔮 [GEMINI] Sending {len(text_to_analyze)} chars to Gemini...")
         
         # Google Gemini REST API endpoint
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{GOOGLE_GEMINI_MODEL}:generateContent?key={GOOGLE_GEMINI_API_KEY}"
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={GOOGLE_GEMINI_API_KEY}"
         
         headers = {
             "Content-Type": "application/json"
@@ -425,7 +1141,7 @@ def analyze_with_gemini(text):
         payload = {
             "contents": [{
                 "parts": [{
-                    "text": f"{SYSTEM_PROMPT}\n\nHere is the insurance policy document to analyze:\n\n{text_to_analyze}"
+                    "text": f"{system_prompt}\n\nHere is the insurance policy document to analyze:\n\n{text_to_analyze}"
                 }]
             }],
             "generationConfig": {
@@ -435,10 +1151,13 @@ def analyze_with_gemini(text):
         }
         
         print(f"🔮 [GEMINI] Sending request to Google API...")
-        response = requests.post(url, headers=headers, json=payload, timeout=60)
+        response = http_session.post(url, headers=headers, json=payload, timeout=60)
         
         print(f"🔮 [GEMINI] Response status: {response.status_code}")
         
+        if response.status_code == 429:
+            provider_router.note(OUTCOME_RATE_LIMITED)
+        
         if response.status_code != 200:
             print(f"❌ [GEMINI] API error: {response.status_code}")
             print(f"❌ [GEMINI] Response: {response.text[:500]}")
@@ -472,6 +1191,7 @@ def analyze_with_gemini(text):
         return parsed_result
         
     except json.JSONDecodeError as e:
+        provider_router.note(OUTCOME_PARSE_FAILURE)
         print(f"❌ [GEMINI] JSON parse error: {e}")
         return None
     except requests.exceptions.Timeout:
@@ -482,7 +1202,7 @@ def analyze_with_gemini(text):
         return None
 
 
-def analyze_with_bytez(text):
+def analyze_with_bytez(text, model=BYTEZ_MODEL, system_prompt=SYSTEM_PROMPT):
     """
     Analyze policy text using Bytez API (tertiary fallback).
     Uses Qwen model via Bytez.
@@ -504,7 +1224,7 @@ def analyze_with_bytez(text):
         text_to_analyze = text[:12000]
         print(f"⚡ [BYTEZ] Sending {len(text_to_analyze)} chars to Bytez...")
         
-        url = f"https://api.bytez.com/models/v2/{BYTEZ_MODEL}"
+        url = f"https://api.bytez.com/models/v2/{model}"
         
         headers = {
             "Authorization": f"Bearer {BYTEZ_API_KEY}",
@@ -521,7 +1241,7 @@ def analyze_with_bytez(text):
                 },
                 {
                     "role": "user",
-                    "content": f"{SYSTEM_PROMPT}\n\nAnalyze this policy content:\n{text_to_analyze}"
+                    "content": f"{system_prompt}\n\nAnalyze this policy content:\n{text_to_analyze}"
                 }
             ],
             "stream": False,
@@ -532,10 +1252,13 @@ def analyze_with_bytez(text):
         }
         
         print(f"⚡ [BYTEZ] Sending request to Bytez API...")
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
+        response = http_session.post(url, json=payload, headers=headers, timeout=60)
         
         print(f"⚡ [BYTEZ] Response status: {response.status_code}")
         
+        if response.status_code == 429:
+            provider_router.note(OUTCOME_RATE_LIMITED)
+        
         if response.status_code != 200:
             print(f"❌ [BYTEZ] API error: {response.status_code}")
             print(f"❌ [BYTEZ] Response: {response.text[:500]}")
@@ -577,6 +1300,10 @@ def analyze_with_bytez(text):
         print(f"✅ [BYTEZ] Analysis successful!")
         return parsed_result
 
+    except json.JSONDecodeError as e:
+        provider_router.note(OUTCOME_PARSE_FAILURE)
+        print(f"❌ [BYTEZ] JSON parse error: {e}")
+        return None
     except Exception as e:
         print(f"❌ [BYTEZ] Unexpected error: {type(e).__name__}: {e}")
         return None
@@ -638,40 +1365,376 @@ def get_mock_analysis():
     }
 
 
-def analyze_policy(text):
+def provider_candidates():
+    """All configured provider models as router keys, in the default fallback order"""
+    candidates = []
+    if OPENROUTER_API_KEY:
+        candidates += [f"openrouter:{model}" for model in FREE_MODELS]
+    if GOOGLE_GEMINI_API_KEY:
+        candidates.append(f"gemini:{GOOGLE_GEMINI_MODEL}")
+    if BYTEZ_API_KEY:
+        candidates.append(f"bytez:{BYTEZ_MODEL}")
+    return candidates
+
+
+PROVIDER_FUNCTIONS = {
+    'openrouter': analyze_with_openrouter,
+    'gemini': analyze_with_gemini,
+    'bytez': analyze_with_bytez,
+}
+
+
+def analyze_policy(text, system_prompt=SYSTEM_PROMPT, mock_fallback=True):
     """
     Analyze policy text using AI.
-    Priority: OpenRouter free models -> Google Gemini -> Bytez (Qwen) -> Mock data
+    Default priority: OpenRouter free models -> Google Gemini -> Bytez (Qwen) -> Mock data,
+    reordered live by provider_router by expected time-to-valid-result.
+    Without mock_fallback, returns None when every provider fails.
     """
     print(f"\n{'='*50}")
     print(f"🔍 [ANALYZE] Starting policy analysis...")
     print(f"{'='*50}")
     
-    # Try OpenRouter first (free models)
-    result = analyze_with_openrouter(text)
-    if result:
-        print(f"✅ [ANALYZE] OpenRouter analysis successful!")
-        return result
-    
-    # Fallback to Google Gemini
-    print(f"⚠️ [ANALYZE] OpenRouter failed. Trying Google Gemini...")
-    result = analyze_with_gemini(text)
-    if result:
-        print(f"✅ [ANALYZE] Google Gemini analysis successful!")
-        return result
-    
-    # Tertiary Fallback to Bytez
-    print(f"⚠️ [ANALYZE] Google Gemini failed. Trying Bytez (Qwen)...")
-    result = analyze_with_bytez(text)
-    if result:
-        print(f"✅ [ANALYZE] Bytez analysis successful!")
-        return result
+    for key in provider_router.order(provider_candidates()):
+        provider, model = key.split(':', 1)
+        print(f"🧭 [ROUTER] Trying {key}")
+        attempt = provider_router.attempt(key)
+        result = None
+        try:
+            result = PROVIDER_FUNCTIONS[provider](text, model, system_prompt)
+        finally:
+            outcome, elapsed = provider_router.finish(attempt, bool(result))
+            print(f"🧭 [ROUTER] {key}: {outcome} in {elapsed:.1f}s")
+            profile = current_profile()
+            if profile is not None:
+                profile.add_provider_attempt(key, outcome, elapsed)
+        if result:
+            print(f"✅ [ANALYZE] {provider} analysis successful!")
+            return result
+    
+    if not mock_fallback:
+        print(f"⚠️ [ANALYZE] All AI providers failed.")
+        return None
     
     # Final fallback to mock data
     print(f"⚠️ [ANALYZE] All AI providers failed. Falling back to mock data.")
     return get_mock_analysis()
 
 
+QA_SYSTEM_PROMPT = """You are InsureScan AI. Answer the user's question about their insurance policy using ONLY the numbered clauses provided.
+
+Return a strictly valid JSON object:
+{"answer": "<short plain-language answer with specific amounts/periods>", "citations": [<clause numbers you relied on>]}
+
+If the clauses do not answer the question, say so in "answer" and return an empty "citations" list. Return ONLY JSON."""
+
+
+def parse_json_response(result_text):
+    """Strip <think> tags / markdown fences from a model reply and parse the JSON object"""
+    import re
+    result_text = re.sub(r'<think>.*?</think>', '', result_text, flags=re.DOTALL).strip()
+    if result_text.startswith('```json'):
+        result_text = result_text[7:]
+    if result_text.startswith('```'):
+        result_text = result_text[3:]
+    if result_text.endswith('```'):
+        result_text = result_text[:-3]
+    result_text = result_text.strip()
+    if "{" in result_text:
+        result_text = result_text[result_text.find("{"):result_text.rfind("}") + 1]
+    return json.loads(result_text)
+
+
+def ask_llm(system_prompt, user_prompt, max_tokens=500, timeout=ASK_TIMEOUT):
+    """
+    Small prompt/response call for short tasks (follow-up Q&A).
+    Tries the first OpenRouter free model, then Gemini, then Bytez.
+    Returns (parsed_json, provider) or (None, None).
+    """
+    attempts = []
+    if OPENROUTER_API_KEY:
+        attempts.append(('openrouter', lambda: http_session.post(
+            "https://openrouter.ai/api/v1/chat/completions",
+            headers={
+                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                "Content-Type": "application/json",
+                "X-Title": "InsureScan - Insurance Policy Analyzer",
+            },
+            json={
+                "model": FREE_MODELS[0],
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "temperature": 0.1,
+                "max_tokens": max_tokens
+            },
+            timeout=timeout
+        ), lambda r: r['choices'][0]['message']['content']))
+    if GOOGLE_GEMINI_API_KEY:
+        attempts.append(('gemini', lambda: http_session.post(
+            f"https://generativelanguage.googleapis.com/v1beta/models/{GOOGLE_GEMINI_MODEL}:generateContent?key={GOOGLE_GEMINI_API_KEY}",
+            headers={"Content-Type": "application/json"},
+            json={
+                "contents": [{"parts": [{"text": f"{system_prompt}\n\n{user_prompt}"}]}],
+                "generationConfig": {"temperature": 0.1, "maxOutputTokens": max_tokens}
+            },
+            timeout=timeout
+        ), lambda r: r['candidates'][0]['content']['parts'][0]['text']))
+    if BYTEZ_API_KEY:
+        attempts.append(('bytez', lambda: http_session.post(
+            f"https://api.bytez.com/models/v2/{BYTEZ_MODEL}",
+            headers={"Authorization": f"Bearer {BYTEZ_API_KEY}", "Content-Type": "application/json"},
+            json={
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "stream": False,
+                "params": {"max_length": max_tokens, "temperature": 0.1}
+            },
+            timeout=timeout
+        ), lambda r: r.get('output', {}).get('content', '')))
+
+    for provider, send, get_content in attempts:
+        try:
+            response = send()
+            print(f"💬 [ASK] {provider} response status: {response.status_code}")
+            if response.status_code != 200:
+                continue
+            return parse_json_response(get_content(response.json())), provider
+        except Exception as e:
+            print(f"❌ [ASK] {provider} failed: {type(e).__name__}: {e}")
+            continue
+    return None, None
+
+
+LATE_FINDINGS_PROMPT = """You are InsureScan AI. Below are extra sections from the later pages of an insurance policy that has already been analysed from its earlier pages.
+
+Report ONLY findings from these sections. Return a strictly valid JSON object:
+{
+    "red_flags": [{"issue": "<specific issue>", "severity": "<high/medium/low>", "impact": "<brief explanation>"}],
+    "good_features": [{"feature": "<feature name>", "benefit": "<how it helps>"}],
+    "coverage_gaps": ["<missing important coverage>"],
+    "recommendations": ["<actionable advice>"]
+}
+
+Be specific with amounts and percentages. Return ONLY JSON."""
+
+
+@profiled('late_findings')
+def analyze_late_findings(text):
+    """Second provider request over the important sections of late pages, routed like the main one"""
+    sections = extract_important_sections(text, max_chars=PIPELINE_LATE_MAX_CHARS)
+    print(f"⏩ [PIPELINE] Sending {len(sections)} chars of late-page sections to AI...")
+    return analyze_policy(sections, system_prompt=LATE_FINDINGS_PROMPT, mock_fallback=False)
+
+
+def merge_late_findings(analysis, findings):
+    """
+    Fold late-page findings into the main analysis, skipping duplicates.
+    Only list fields are merged, and only into lists; anything else is ignored.
+    """
+    list_fields = {
+        'red_flags': 'issue',
+        'good_features': 'feature',
+        'coverage_gaps': None,
+        'recommendations': None,
+    }
+    if not isinstance(analysis, dict) or not isinstance(findings, dict):
+        return 0
+    added = 0
+    for field, key in list_fields.items():
+        new_items = findings.get(field) or []
+        if not isinstance(new_items, list):
+            continue
+        existing = analysis.setdefault(field, [])
+        if not isinstance(existing, list):
+            continue
+        seen = {
+            str(item.get(key, '') if key and isinstance(item, dict) else item).strip().lower()
+            for item in existing
+        }
+        for item in new_items:
+            label = str(item.get(key, '') if key and isinstance(item, dict) else item).strip().lower()
+            if label and label not in seen:
+                existing.append(item)
+                seen.add(label)
+                added += 1
+    return added
+
+
+def ready_for_early_analysis(pages, elapsed):
+    """
+    Extraction has been slow (OCR, long PDFs) and enough high-scoring sections
+    are extracted so far to start the main provider request
+    """
+    if elapsed < PIPELINE_SLOW_SECONDS:
+        return False
+    text = "\n".join(pages)
+    if len(text) < PIPELINE_START_CHARS:
+        return False
+    sections = sum(1 for para in text.split('\n') if len(para.strip()) > 30 and score_paragraph(para) > 0)
+    return sections >= PIPELINE_MIN_SECTIONS
+
+
+def extract_and_analyze_pipelined(file_paths, pages=None):
+    """
+    Pipelined mode: once extraction has run for PIPELINE_SLOW_SECONDS, start
+    the main provider request (overview, risk scores) as soon as the pages so
+    far hold enough important sections, keep extracting in the meantime, then
+    fold findings from the remaining pages in with a second request.
+    Returns (extracted_text, analysis, pipeline_info); analysis is None when
+    the document finished extracting before the early start triggered.
+    """
+    page_texts = []
+    early_future = None
+    early_pages = 0
+    started = time.monotonic()
+    with profile_stage('extraction') as stage, cprofile_block():
+        for page_text in iter_document_pages(file_paths, pages):
+            page_texts.append(page_text)
+            if early_future is None and ready_for_early_analysis(page_texts, time.monotonic() - started):
+                early_pages = len(page_texts)
+                early_text = clean_extracted_text("\n".join(page_texts)).strip()
+                print(f"⏩ [PIPELINE] Starting AI analysis after {early_pages} page(s) ({len(early_text)} chars), extraction continues")
+                early_future = analysis_executor.submit(bind_context(analyze_policy), early_text)
+        stage['pages'] = len(page_texts)
+        stage['chars_raw'] = sum(len(page) for page in page_texts)
+
+    with profile_stage('clean') as stage:
+        extracted_text = clean_extracted_text("\n".join(page_texts)).strip()
+        stage['chars_out'] = len(extracted_text)
+    if early_future is None:
+        return extracted_text, None, None
+
+    late_text = clean_extracted_text("\n".join(page_texts[early_pages:])).strip()
+    late_future = None
+    if late_text and any(len(p.strip()) > 30 and score_paragraph(p) > 0 for p in late_text.split('\n')):
+        late_future = analysis_executor.submit(bind_context(analyze_late_findings), late_text)
+
+    with profile_stage('analysis_wait'):
+        analysis = early_future.result()
+    pipeline_info = {"early_pages": early_pages, "total_pages": len(page_texts), "late_findings_added": 0}
+    # Mock fallback means no provider worked; don't decorate it with real findings
+    if late_future is not None and isinstance(analysis, dict) and analysis.get('processing_mode') != 'mock':
+        try:
+            findings = late_future.result()
+            if findings:
+                pipeline_info["late_findings_added"] = merge_late_findings(analysis, findings)
+                print(f"⏩ [PIPELINE] Merged {pipeline_info['late_findings_added']} late-page finding(s)")
+        except Exception as e:
+            print(f"⚠️ [PIPELINE] Dropping late-page findings: {type(e).__name__}: {e}")
+    return extracted_text, analysis, pipeline_info
+
+
+warm_state = {"warm": False, "started_at": None, "finished_at": None, "steps": {}}
+_warm_lock = threading.Lock()
+# A worker whose warm-up failed retries it (from /ready) at most this often
+WARM_RETRY_SECONDS = 30
+
+
+def _warm_step(name, fn):
+    """Run one warm-up step, recording its duration and outcome in warm_state. Returns True on success."""
+    started = time.monotonic()
+    try:
+        detail = fn()
+        warm_state["steps"][name] = {"ok": True, "ms": round((time.monotonic() - started) * 1000)}
+        if detail:
+            warm_state["steps"][name]["detail"] = detail
+        return True
+    except Exception as e:
+        warm_state["steps"][name] = {"ok": False, "ms": round((time.monotonic() - started) * 1000), "error": f"{type(e).__name__}: {e}"}
+        print(f"⚠️ [WARM-UP] {name} failed: {e}")
+        return False
+
+
+def _warm_pdf():
+    """Load the PDF engine and parse a tiny one-page PDF with it"""
+    import tempfile
+    from PyPDF2 import PdfWriter
+    writer = PdfWriter()
+    writer.add_blank_page(width=72, height=72)
+    with tempfile.NamedTemporaryFile(suffix='.pdf', dir=UPLOAD_FOLDER, delete=False) as f:
+        writer.write(f)
+    try:
+        document = pdf_engine.open(f.name)
+        document.page_text(0)
+        document.close()
+    finally:
+        os.remove(f.name)
+
+
+def _warm_ocr():
+    """Run tesseract once on a tiny image so the first real page isn't paying for startup"""
+    from PIL import ImageDraw
+    image = Image.new('L', (200, 40), 255)
+    ImageDraw.Draw(image).text((5, 10), "InsureScan 123", fill=0)
+    ocr_frame(image)
+
+
+def _warm_providers():
+    """Open pooled TLS connections to the configured provider hosts"""
+    configured = {
+        'openrouter': bool(OPENROUTER_API_KEY),
+        'gemini': bool(GOOGLE_GEMINI_API_KEY),
+        'bytez': bool(BYTEZ_API_KEY),
+    }
+    results = {}
+    for provider, url in PROVIDER_HOSTS.items():
+        if not configured[provider]:
+            continue
+        try:
+            # Any HTTP status is fine - we only want the connection in the pool
+            results[provider] = http_session.head(url, timeout=5).status_code
+        except requests.exceptions.RequestException as e:
+            results[provider] = f"unreachable: {type(e).__name__}"
+    return results
+
+
+def warm_up():
+    """
+    Worker warm-up: preload extraction libraries, run a tiny PDF parse and
+    OCR, and open provider connections. Called once per worker at boot
+    (gunicorn post_worker_init, or a background thread in dev mode).
+    The worker is warm only if the PDF and OCR steps succeed; provider
+    reachability is informational (the router handles unreachable ones).
+    """
+    with _warm_lock:
+        if warm_state["warm"]:
+            return warm_state
+        print(f"🔥 [WARM-UP] Warming worker {os.getpid()}...")
+        warm_state["started_at"] = time.time()
+        pdf_ok = _warm_step('pdf', _warm_pdf)
+        ocr_ok = _warm_step('ocr', _warm_ocr)
+        _warm_step('providers', _warm_providers)
+        warm_state["finished_at"] = time.time()
+        warm_state["warm"] = pdf_ok and ocr_ok
+        if warm_state["warm"]:
+            print(f"🔥 [WARM-UP] Done: {warm_state['steps']}")
+        else:
+            print(f"⚠️ [WARM-UP] Not ready, will retry: {warm_state['steps']}")
+        return warm_state
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness for the load balancer: 200 only once this worker is warm"""
+    finished_at = warm_state["finished_at"]
+    if (not warm_state["warm"] and finished_at is not None
+            and time.time() - finished_at > WARM_RETRY_SECONDS and not _warm_lock.locked()):
+        threading.Thread(target=warm_up, daemon=True).start()
+    candidates = provider_candidates()
+    body = {
+        "ready": warm_state["warm"],
+        "pid": os.getpid(),
+        "warm_up": warm_state["steps"],
+        "providers": provider_router.circuits(candidates),
+        "load": analysis_gate.stats(),
+    }
+    return jsonify(body), (200 if warm_state["warm"] else 503)
+
+
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -679,11 +1742,18 @@ def health_check():
         "status": "healthy",
         "service": "InsureScan API",
         "version": "1.0.0",
-        "ai_providers": ["OpenRouter (free)", "Google Gemini", "Bytez (Qwen)", "Mock fallback"]
+        "ai_providers": ["OpenRouter (free)", "Google Gemini", "Bytez (Qwen)", "Mock fallback"],
+        "load": analysis_gate.stats(),
+        "ocr": ocr_engine.stats(),
+        "pdf_engine": pdf_engine.name,
+        "response_cache": response_cache.stats(),
+        "ocr_dedup": ocr_cache.stats() if ocr_cache is not None else None,
+        "coalesced_requests": upload_flights.coalesced
     })
 
 
 @app.route('/analyze', methods=['POST'])
+@with_backpressure
 def analyze():
     """
     Main endpoint for analyzing insurance policy documents.
@@ -698,87 +1768,295 @@ def analyze():
     
     if demo_mode == 'true':
         print(f"🎯 [DEMO MODE] Returning Smart Policy Report demo response")
-        demo_response = get_mock_analysis()
-        demo_response["processing_mode"] = "demo"
-        return jsonify(demo_response)
+        return response_cache.respond('analyze_demo', get_demo_analysis, max_age=RESPONSE_CACHE_MAX_AGE)
     
-    # Check if file was uploaded
+    return analyze_upload()
+
+
+def analyze_upload():
+    """Extract and analyze the uploaded file (admitted through analysis_gate)"""
+    # Opt-in profiling for admins: profile=1 (timings) or profile=cprofile (+ cProfile of extraction)
+    profile_flag = (request.form.get('profile') or request.args.get('profile') or '').strip().lower()
+    if profile_flag in ('1', 'true', 'cprofile'):
+        if not is_admin_request():
+            return jsonify({"error": "Profiling requires a valid X-Admin-Key header."}), 403
+        profile, token = start_profile(with_cprofile=profile_flag == 'cprofile')
+        try:
+            response = process_upload()
+            # Error paths return (response, status) tuples; only decorate successes
+            if not isinstance(response, tuple) and response.status_code == 200:
+                body = response.get_json()
+                body['timings'] = profile.to_dict()
+                if profile.cprofile_summary:
+                    body['cprofile'] = profile.cprofile_summary
+                response = jsonify(body)
+            return response
+        finally:
+            stop_profile(token)
+    return process_upload()
+
+
+def is_admin_request():
+    """Constant-time check of the X-Admin-Key header against ADMIN_API_KEY"""
+    supplied = request.headers.get('X-Admin-Key', '')
+    return bool(ADMIN_API_KEY) and hmac.compare_digest(supplied.encode(), ADMIN_API_KEY.encode())
+
+
+def process_upload():
+    """Validate the uploaded file(s), then analyze them (coalescing identical uploads)"""
+    # Check if file(s) were uploaded - several images (e.g. one photo per page)
+    # may be sent as repeated 'file' fields or as 'files'
     print(f"📥 [REQUEST] Files in request: {list(request.files.keys())}")
     
-    if 'file' not in request.files:
+    files = request.files.getlist('file') + request.files.getlist('files')
+    if not files:
         print(f"❌ [REQUEST] No file in request!")
         return jsonify({"error": "No file provided. Please upload a PDF or image file."}), 400
     
-    file = request.files['file']
-    print(f"📥 [REQUEST] File name: {file.filename}")
-    print(f"📥 [REQUEST] File content type: {file.content_type}")
+    if len(files) > MAX_UPLOAD_FILES:
+        return jsonify({"error": f"Too many files. Upload at most {MAX_UPLOAD_FILES} files at once."}), 400
     
-    if file.filename == '':
-        return jsonify({"error": "No file selected. Please choose a file to upload."}), 400
+    for file in files:
+        print(f"📥 [REQUEST] File name: {file.filename}")
+        print(f"📥 [REQUEST] File content type: {file.content_type}")
+        
+        if file.filename == '':
+            return jsonify({"error": "No file selected. Please choose a file to upload."}), 400
+        
+        if not allowed_file(file.filename):
+            return jsonify({
+                "error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+            }), 400
     
-    if not allowed_file(file.filename):
+    # Optional page selection for very large documents, e.g. pages=1-5,8 or pages=20-
+    pages_spec = (request.form.get('pages') or request.args.get('pages') or '').strip()
+    try:
+        pages = parse_page_ranges(pages_spec) if pages_spec else None
+    except ValueError as e:
         return jsonify({
-            "error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
+            "error": f"Invalid pages parameter: {e}",
+            "hint": "Use page numbers and ranges, e.g. pages=1-5,8 or pages=20-"
         }), 400
     
+    # Identical concurrent uploads share one extract -> LLM run; profiled
+    # requests always run on their own so their timings are real
+    key = upload_content_key(files, pages) if SINGLE_FLIGHT_ENABLED and not current_profile() else None
+    (result, status, _), coalesced = upload_flights.run(key, lambda: save_and_analyze(files, pages))
+    if status != 200:
+        return jsonify(result), status
+    if coalesced:
+        result['coalesced'] = True
+    return jsonify(result)
+
+
+def upload_content_key(files, pages=None):
+    """sha256 over the uploaded files' bytes, in upload order (and the page selection)"""
+    digest = hashlib.sha256()
+    if pages:
+        digest.update(f"pages={format_page_ranges(pages)}\0".encode())
+    for file in files:
+        for block in iter(lambda: file.stream.read(1024 * 1024), b''):
+            digest.update(block)
+        file.stream.seek(0)
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def spooled_file_path(file):
+    """
+    Path of an upload on disk: its spool file when SpooledRequest streamed it,
+    else a fresh unique file it is copied to. Returns (path, created_here).
+    """
+    stream = getattr(file.stream, 'name', None)
+    if isinstance(stream, str) and os.path.dirname(stream) == UPLOAD_SPOOL_FOLDER:
+        file.stream.flush()
+        return stream, False
+    suffix = '.' + secure_filename(file.filename).rsplit('.', 1)[-1].lower()
+    fd, file_path = tempfile.mkstemp(dir=UPLOAD_FOLDER, prefix='upload_', suffix=suffix)
+    os.close(fd)
+    file.save(file_path)
+    return file_path, True
+
+
+def save_and_analyze(files, pages=None):
+    """
+    Extract and analyze validated uploads (optionally only some pages).
+    Returns (body, status, real_ai); real_ai is True only for a provider's
+    analysis, the one kind of result identical uploads may reuse.
+    """
+    file_paths = []
+    created_paths = []
     try:
-        # Save the uploaded file
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        print(f"💾 [FILE] Saved to: {file_path}")
-        print(f"💾 [FILE] File size: {os.path.getsize(file_path)} bytes")
-        
-        # Extract text based on file type
-        file_extension = filename.rsplit('.', 1)[1].lower()
-        print(f"📄 [FILE] Extension: {file_extension}")
-        
-        if file_extension == 'pdf':
-            extracted_text = extract_text_from_pdf(file_path)
-        else:
-            extracted_text = extract_text_from_image(file_path)
+        # Each upload already sits in its own uniquely named spool file
+        for file in files:
+            with profile_stage('save', file=secure_filename(file.filename)) as stage:
+                file_path, created = spooled_file_path(file)
+                stage['bytes'] = os.path.getsize(file_path)
+            file_paths.append(file_path)
+            if created:
+                created_paths.append(file_path)
+            print(f"💾 [FILE] {file.filename} at: {file_path}")
+            print(f"💾 [FILE] File size: {stage['bytes']} bytes")
         
-        # Clean up - remove the uploaded file
-        try:
-            os.remove(file_path)
-            print(f"🗑️ [FILE] Cleaned up temp file")
-        except:
-            pass
+        # Extract text based on file type(s); in pipelined mode the AI
+        # request may already be running by the time extraction finishes
+        analysis = None
+        pipeline_info = None
+        if PIPELINE_ENABLED:
+            extracted_text, analysis, pipeline_info = extract_and_analyze_pipelined(file_paths, pages)
+        else:
+            with profile_stage('extraction') as stage, cprofile_block():
+                extracted_text = extract_text_from_files(file_paths, pages)
+                stage['chars_out'] = len(extracted_text)
         
         # Validate extracted text
         print(f"📝 [TEXT] Extracted text length: {len(extracted_text)} characters")
         
         if not extracted_text or len(extracted_text) < 50:
             print(f"❌ [TEXT] Insufficient text extracted!")
-            return jsonify({
+            return {
                 "error": "Could not extract sufficient text from the document. Please ensure the file is readable and contains text.",
                 "hint": "For images, ensure the text is clear and not blurry. For PDFs, ensure they are not scanned images without OCR."
-            }), 400
+            }, 400, False
         
-        # Analyze the policy with real AI
-        analysis = analyze_policy(extracted_text)
+        # Analyze the policy with real AI (unless the pipeline already did)
+        if analysis is None:
+            with profile_stage('analyze', chars_in=len(extracted_text)):
+                analysis = analyze_policy(extracted_text)
         
         # Add metadata
         analysis['text_length'] = len(extracted_text)
-        analysis['processing_mode'] = 'ai' if 'safety_score' in analysis else 'mock'
+        if pages:
+            analysis['pages'] = format_page_ranges(pages)
+        if pipeline_info:
+            analysis['pipeline'] = pipeline_info
+        try:
+            with profile_stage('index'):
+                analysis['document_id'] = document_store.add(extracted_text)
+        except Exception as e:
+            print(f"⚠️ [INDEX] Could not index document for Q&A: {e}")
+        # The mock fallback arrives labelled 'mock'; provider results are relabelled 'ai'
+        real_ai = 'safety_score' in analysis and analysis.get('processing_mode') != 'mock'
+        analysis['processing_mode'] = 'ai' if real_ai else 'mock'
         
         print(f"\n✅ [RESPONSE] Sending analysis response!")
         print(f"✅ [RESPONSE] Processing mode: {analysis['processing_mode']}")
         
-        return jsonify(analysis)
+        return analysis, 200, real_ai
+    
+    except PageSelectionError as e:
+        print(f"❌ [TEXT] {e}")
+        return {
+            "error": str(e),
+            "hint": f"Choose pages between 1 and {e.total_pages}, e.g. pages={format_page_ranges([(1, e.total_pages)])}"
+        }, 400, False
     
     except Exception as e:
         print(f"❌ [ERROR] {type(e).__name__}: {e}")
-        return jsonify({
+        return {
             "error": f"Error processing file: {str(e)}",
             "hint": "Please try again or use a different file format."
-        }), 500
+        }, 500, False
+    
+    finally:
+        # Clean up - copies made here; spool files go when the request ends
+        for file_path in created_paths:
+            try:
+                os.remove(file_path)
+                print(f"🗑️ [FILE] Cleaned up temp file")
+            except OSError:
+                pass
+
+
+@app.route('/providers/stats', methods=['GET'])
+def provider_stats():
+    """Live routing stats per provider model (this worker process)"""
+    candidates = provider_candidates()
+    return jsonify({
+        "order": provider_router.order(candidates) if candidates else [],
+        "models": provider_router.stats()
+    })
+
+
+def get_demo_analysis():
+    """Mock analysis labelled as a demo (the /analyze demo_mode payload)"""
+    demo_response = get_mock_analysis()
+    demo_response["processing_mode"] = "demo"
+    return demo_response
 
 
 @app.route('/demo', methods=['GET'])
 def demo():
-    """Quick demo endpoint - returns mock analysis without file upload"""
-    return jsonify(get_mock_analysis())
+    """
+    Quick demo endpoint - returns mock analysis without file upload.
+    Served pre-serialized/compressed with an ETag; supports ?fields=a,b.
+    """
+    return response_cache.respond('demo', get_mock_analysis, max_age=RESPONSE_CACHE_MAX_AGE)
+
+
+@app.route('/ask', methods=['POST'])
+@with_ask_limit
+def ask():
+    """
+    Follow-up question about an analysed policy.
+    Body (JSON or form): document_id (from /analyze), question, optional top_k.
+    Only the top-k matching clauses are sent to the AI provider.
+    """
+    data = request.get_json(silent=True) or request.form
+    document_id = (data.get('document_id') or '').strip()
+    question = (data.get('question') or '').strip()
+    try:
+        top_k = max(1, min(int(data.get('top_k') or ASK_TOP_K), 10))
+    except (TypeError, ValueError):
+        top_k = ASK_TOP_K
+    print(f"\n💬 [ASK] Question for {document_id}: {question[:200]}")
+
+    if not question:
+        return jsonify({"error": "Please provide a question."}), 400
+
+    index = document_store.get(document_id)
+    if index is None:
+        return jsonify({
+            "error": "Unknown or expired document_id.",
+            "hint": "Analyze the policy again to ask follow-up questions."
+        }), 404
+
+    hits = index.search(question, top_k=top_k)
+    citations = [
+        {"clause": rank + 1, "text": index.chunks[idx], "score": round(score, 3)}
+        for rank, (idx, score) in enumerate(hits)
+    ]
+    if not citations:
+        return jsonify({
+            "answer": "No clause in this policy matches your question.",
+            "citations": [],
+            "processing_mode": "retrieval"
+        })
+
+    clauses = "\n\n".join(f"[{c['clause']}] {c['text']}" for c in citations)
+    print(f"💬 [ASK] Sending {len(clauses)} chars from {len(citations)} clauses to AI...")
+    result, provider = ask_llm(QA_SYSTEM_PROMPT, f"Clauses:\n{clauses}\n\nQuestion: {question}")
+
+    if not isinstance(result, dict) or not result.get('answer'):
+        # No provider available: fall back to the retrieved clauses themselves
+        return jsonify({
+            "answer": "Here are the policy clauses most relevant to your question.",
+            "citations": citations,
+            "processing_mode": "retrieval"
+        })
+
+    cited = set()
+    clauses_cited = result.get('citations')
+    for clause in clauses_cited if isinstance(clauses_cited, list) else []:
+        try:
+            cited.add(int(clause))
+        except (TypeError, ValueError):
+            continue
+    return jsonify({
+        "answer": result['answer'],
+        "citations": [c for c in citations if c['clause'] in cited] or citations,
+        "processing_mode": provider
+    })
 
 
 if __name__ == '__main__':
@@ -793,8 +2071,15 @@ if __name__ == '__main__':
     print("   GET  /         - Health check")
     print("   POST /analyze  - Analyze policy document")
     print("   GET  /demo     - Get demo analysis")
+    print("   GET  /ready    - Readiness (warm worker, provider circuits)")
+    print("   POST /ask      - Follow-up question on an analysed policy")
+    print("   GET  /providers/stats - Live provider routing stats")
     print("")
     print("🔍 DEBUG LOGGING ENABLED - Watch console for detailed logs!")
     print("=" * 60)
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    threading.Thread(target=warm_up, daemon=True).start()
+    
+    # threaded=True so a slow provider call doesn't block the dev server;
+    # for production use gunicorn with gunicorn.conf.py (gthread/gevent workers)
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True)
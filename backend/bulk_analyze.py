@@ -0,0 +1,189 @@
+"""
+InsureScan - Offline bulk analysis.
+
+Re-scores a directory of archived policies without going through the Flask
+/analyze route. Text extraction runs across a process pool, provider calls
+run under a concurrency cap, and every finished document is appended to a
+JSONL file. That file doubles as the checkpoint: re-running the same
+command skips documents that already have a result (keyed by relative path
+and content hash) and retries ones whose providers failed.
+
+Usage:
+    python bulk_analyze.py /path/to/policies --output results.jsonl \
+        --workers 4 --concurrency 3
+"""
+
+import os
+
+# Each extraction process OCRs one document at a time; parallelism comes
+# from the process pool. Archives hold many same-template policies, so OCR
+# text is never reused between documents. Must be set before importing app.
+os.environ.setdefault('OCR_MAX_WORKERS', '1')
+os.environ.setdefault('PIPELINE_ENABLED', 'false')
+os.environ.setdefault('OCR_DEDUP_ENABLED', 'false')
+
+import sys
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Statuses that count as finished on resume; anything else is retried
+DONE_STATUSES = {'ok', 'no_text'}
+
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def discover_documents(input_dir):
+    """All supported policy files under input_dir, in a stable order"""
+    from app import allowed_file
+    found = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if allowed_file(name):
+                found.append(os.path.join(root, name))
+    return found
+
+
+def load_checkpoint(output_path):
+    """Keys of documents already finished in a previous run"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn last line from an interrupted run
+            if record.get('status') in DONE_STATUSES:
+                done.add(record.get('key'))
+    return done
+
+
+def extract_document(file_path):
+    """Runs in a worker process: extract text with the same functions as /analyze"""
+    from app import extract_text_from_files
+    started = time.monotonic()
+    text = extract_text_from_files([file_path])
+    return text, round(time.monotonic() - started, 2)
+
+
+def analyze_document(text):
+    """Runs in a thread: provider chain via analyze_policy"""
+    from app import analyze_policy
+    started = time.monotonic()
+    analysis = analyze_policy(text)
+    return analysis, round(time.monotonic() - started, 2)
+
+
+def write_record(out, record):
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+    os.fsync(out.fileno())
+
+
+def run(input_dir, output_path, workers, concurrency, limit=None):
+    from policy_index import document_id_for
+
+    documents = discover_documents(input_dir)
+    done = load_checkpoint(output_path)
+    todo = []
+    for file_path in documents:
+        relative = os.path.relpath(file_path, input_dir)
+        key = f"{relative}:{file_sha256(file_path)}"
+        if key not in done:
+            todo.append((file_path, relative, key))
+    if limit:
+        todo = todo[:limit]
+    print(f"📦 [BULK] {len(documents)} documents found, {len(documents) - len(todo)} already done, {len(todo)} to process",
+          file=sys.stderr)
+
+    counts = {}
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as extract_pool, \
+            ThreadPoolExecutor(max_workers=concurrency) as analyze_pool, \
+            open(output_path, 'a', encoding='utf-8') as out:
+        queue = iter(todo)
+        extracting = {}
+        analyzing = {}
+
+        def fill_extraction():
+            # Keep the process pool busy without holding every document's text in memory
+            while len(extracting) < workers * 2 and len(analyzing) < concurrency * 2:
+                item = next(queue, None)
+                if item is None:
+                    return
+                extracting[extract_pool.submit(extract_document, item[0])] = item
+
+        def finish(item, status, **fields):
+            file_path, relative, key = item
+            record = {"key": key, "path": relative, "status": status}
+            record.update(fields)
+            write_record(out, record)
+            counts[status] = counts.get(status, 0) + 1
+            print(f"📦 [BULK] {relative}: {status} ({sum(counts.values())}/{len(todo)})", file=sys.stderr)
+
+        fill_extraction()
+        while extracting or analyzing:
+            finished, _ = wait(list(extracting) + list(analyzing), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in extracting:
+                    item = extracting.pop(future)
+                    try:
+                        text, extract_seconds = future.result()
+                    except Exception as e:
+                        finish(item, 'extract_failed', error=str(e))
+                        continue
+                    if not text or len(text) < 50:
+                        finish(item, 'no_text', extract_seconds=extract_seconds)
+                        continue
+                    analysis_future = analyze_pool.submit(analyze_document, text)
+                    analyzing[analysis_future] = (item, text, extract_seconds)
+                else:
+                    item, text, extract_seconds = analyzing.pop(future)
+                    try:
+                        analysis, analyze_seconds = future.result()
+                    except Exception as e:
+                        finish(item, 'analyze_failed', error=str(e), extract_seconds=extract_seconds)
+                        continue
+                    # Mock data means every provider failed - retry on the next run
+                    status = 'provider_failed' if analysis.get('processing_mode') == 'mock' else 'ok'
+                    finish(item, status,
+                           document_id=document_id_for(text),
+                           text_length=len(text),
+                           extract_seconds=extract_seconds,
+                           analyze_seconds=analyze_seconds,
+                           analysis=analysis)
+            fill_extraction()
+
+    print(f"📦 [BULK] Finished: {counts}", file=sys.stderr)
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-analyze a directory of insurance policies")
+    parser.add_argument('input_dir', help="directory of policy PDFs/images (searched recursively)")
+    parser.add_argument('--output', default='results.jsonl', help="JSONL results file, also used to resume")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help="extraction processes")
+    parser.add_argument('--concurrency', type=int, default=3, help="simultaneous provider calls")
+    parser.add_argument('--limit', type=int, default=None, help="process at most N new documents")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"{args.input_dir} is not a directory")
+    counts = run(args.input_dir, args.output, max(1, args.workers), max(1, args.concurrency), args.limit)
+    return 0 if not any(status not in DONE_STATUSES for status in counts) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,58 @@
+"""
+Gunicorn config for InsureScan - high-concurrency serving profile.
+
+Provider calls spend up to 60s per attempt waiting on the network, so sync
+workers (one request each) are a poor fit. By default we run threaded
+(gthread) workers; set WORKER_CLASS=gevent (and `pip install gevent`) to use
+greenlets instead. Admission control/backpressure lives in app.py
+(MAX_INFLIGHT_ANALYSES / MAX_QUEUED_ANALYSES / RESERVED_THREADS).
+
+Start with:  gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# Free tier instances are small; one or two processes is plenty since
+# most of the time is spent waiting on AI providers, not CPU.
+workers = int(os.getenv('WEB_CONCURRENCY', min(2, multiprocessing.cpu_count())))
+
+worker_class = os.getenv('WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        print("⚠️ [GUNICORN] gevent not installed, falling back to gthread workers")
+        worker_class = 'gthread'
+
+# gthread: threads per worker. gevent: max simultaneous greenlets per worker.
+# Keep this at least MAX_INFLIGHT_ANALYSES + MAX_QUEUED_ANALYSES + MAX_BATCH_QUEUED
+# + ASK_MAX_INFLIGHT + RESERVED_THREADS (8 + 8 + 8 + 4 + 4 by default) so the
+# app's queues fill and shed load with 503s before the thread pool does.
+threads = int(os.getenv('WORKER_THREADS', '32'))
+worker_connections = int(os.getenv('WORKER_CONNECTIONS', '100'))
+
+# Keep the listen backlog small so excess load is shed by the app's 503s
+# rather than piling up unseen in the kernel queue.
+backlog = int(os.getenv('GUNICORN_BACKLOG', '64'))
+
+# OpenRouter can walk through 5 models, then Gemini and Bytez: allow for a
+# slow chain but still recycle genuinely stuck workers.
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '240'))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers periodically to keep OCR/PDF memory growth in check
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '500'))
+max_requests_jitter = 50
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_worker_init(worker):
+    """Warm each worker (libraries, tiny OCR/PDF parse, provider TLS) before it serves traffic"""
+    from app import warm_up
+    warm_up()
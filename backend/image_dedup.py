@@ -0,0 +1,227 @@
+"""
+InsureScan - Perceptual-hash OCR reuse for re-photographed policy pages.
+
+Users often upload the same page again after a blurry first shot. Byte
+hashes miss these, so each recently OCR'd frame is fingerprinted with a
+1024-bit difference hash (dHash) plus a sharpness score. Both the hash and
+the glyph map below are taken from the frame's content box (the page
+cropped to its ink), so the same page uploaded at another offset or with a
+different border still lines up. A new frame within a small Hamming
+distance of a known one reuses its OCR text, unless the new shot is clearly
+sharper, in which case it is OCR'd again and replaces the old entry.
+
+Pages printed from the same insurer template (another customer's schedule,
+the next member page of one scan) differ only in a few words and sit within
+a few bits of each other, so a hash match is never enough on its own:
+entries only match lookups from the same scope (the uploading client), and
+each candidate is confirmed by comparing bilevel 1024-px renderings of both
+content boxes tile by tile, each tile at its best shift of up to
+ALIGN_SHIFT px. A changed name or digit leaves at least one tile with many
+differing pixels; a re-encoded, re-uploaded or shifted copy does not.
+
+In practice this detects repeat uploads of the same image, not true
+re-shots: blur, rotation or scale changes of even 1 px / 0.5 degrees / 2%
+flip as many glyph pixels as a changed digit (a 5 -> 6 in a sum insured),
+and tolerating them would let such edits through. Those shots fall through
+to a normal OCR. The sharper-shot path still applies to exposure: a dim,
+washed-out upload followed by a well-lit one confirms as the same page (the
+glyph map is autocontrasted) but is clearly sharper, so it is OCR'd again.
+
+Lookups use multi-index hashing: the hash is split into 16-bit bands and
+any hash within `max_distance` bits (< number of bands) must match at least
+one band exactly (pigeonhole), so only those candidates are compared.
+"""
+
+import zlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
+
+HASH_SIZE = 32                    # 32x32 gradient grid -> 1024-bit hash
+HASH_BITS = HASH_SIZE * HASH_SIZE
+BAND_BITS = 16
+BAND_COUNT = HASH_BITS // BAND_BITS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+GLYPH_WIDTH = 1024                # bilevel rendering used to confirm matches (~8 KB packed)
+GLYPH_TILE = 16
+GLYPH_MARGIN = 4                  # blank border kept around the content box
+INK_LEVEL = 160                   # darker than this (after autocontrast) counts as ink
+ALIGN_SHIFT = 2                   # per-tile shift search, px either way
+# Most pixels of one 16x16 tile allowed to differ at its best shift; a changed digit flips 20+,
+# a JPEG re-encode or shifted copy ~10
+MAX_TILE_DIFF_PIXELS = 16
+
+
+def dhash(image):
+    """1024-bit difference hash: compares horizontally adjacent pixels of a 33x32 thumbnail"""
+    gray = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def sharpness(image, max_side=512):
+    """Edge-energy sharpness score (variance of an edge-filtered grayscale copy)"""
+    gray = image.convert('L')
+    if max(gray.size) > max_side:
+        scale = max_side / max(gray.size)
+        gray = gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale))))
+    return ImageStat.Stat(gray.filter(ImageFilter.FIND_EDGES)).var[0]
+
+
+def content_box(image):
+    """Autocontrasted grayscale copy of the frame cropped to its ink"""
+    gray = ImageOps.autocontrast(image.convert('L'), cutoff=1)
+    box = gray.point(lambda v: 255 if v < INK_LEVEL else 0).getbbox()
+    return gray.crop(box) if box else gray
+
+
+def glyph_map(content):
+    """Ink/no-ink rendering of a content box at GLYPH_WIDTH px plus a blank margin, as (size, zlib-packed bits)"""
+    height = max(1, round(GLYPH_WIDTH * content.height / content.width)) if content.width else 1
+    ink = content.resize((GLYPH_WIDTH, height), Image.BOX).point(lambda v: 255 if v < INK_LEVEL else 0)
+    framed = Image.new('L', (GLYPH_WIDTH + 2 * GLYPH_MARGIN, height + 2 * GLYPH_MARGIN), 0)
+    framed.paste(ink, (GLYPH_MARGIN, GLYPH_MARGIN))
+    framed = framed.convert('1')
+    return framed.size, zlib.compress(framed.tobytes())
+
+
+def _unpack(glyphs):
+    size, packed = glyphs
+    return Image.frombytes('1', size, zlib.decompress(packed)).convert('L')
+
+
+def _shifted(image, dx, dy):
+    moved = Image.new('L', image.size, 0)
+    moved.paste(image, (dx, dy))
+    return moved
+
+
+def same_content(a, b):
+    """
+    True if every tile of the two glyph maps, at its best shift of up to
+    ALIGN_SHIFT px, differs in at most MAX_TILE_DIFF_PIXELS pixels
+    """
+    first, second = _unpack(a), _unpack(b)
+    if second.size != first.size:
+        second = second.resize(first.size, Image.NEAREST)
+    tiles = ((first.width + GLYPH_TILE - 1) // GLYPH_TILE, (first.height + GLYPH_TILE - 1) // GLYPH_TILE)
+    padded = (0, 0, tiles[0] * GLYPH_TILE, tiles[1] * GLYPH_TILE)
+    shifts = range(-ALIGN_SHIFT, ALIGN_SHIFT + 1)
+    best = None
+    for dy in shifts:
+        for dx in shifts:
+            diff = ImageChops.difference(first, _shifted(second, dx, dy)).crop(padded)
+            # Box-averaging per tile gives each tile's share of differing pixels (0..255)
+            share = diff.resize(tiles, Image.BOX, reducing_gap=None)
+            best = share if best is None else ImageChops.darker(best, share)
+    _, worst = best.getextrema()
+    return worst * GLYPH_TILE * GLYPH_TILE / 255 <= MAX_TILE_DIFF_PIXELS
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class Fingerprint:
+    """Perceptual hash, aspect ratio and glyph map of one frame's content box, plus its sharpness"""
+
+    __slots__ = ('hash', 'sharpness', 'aspect', 'glyphs')
+
+    def __init__(self, image):
+        content = content_box(image)
+        self.hash = dhash(content)
+        self.sharpness = sharpness(image)
+        self.aspect = content.width / content.height if content.height else 0
+        self.glyphs = glyph_map(content)
+
+
+class PerceptualOCRCache:
+    """
+    Bounded LRU of recently OCR'd frames with a Hamming-distance band index.
+    Entries are kept per scope (e.g. client id) and never match across scopes.
+    """
+
+    def __init__(self, capacity=512, max_distance=32, sharper_ratio=1.25, aspect_tolerance=0.1):
+        if max_distance >= BAND_COUNT:
+            raise ValueError(f"max_distance must be below {BAND_COUNT}")
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.sharper_ratio = sharper_ratio
+        self.aspect_tolerance = aspect_tolerance
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # entry id -> (scope, fingerprint, text)
+        self._bands = {}               # (band index, band value) -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _band_keys(value):
+        return [(band, (value >> (band * BAND_BITS)) & BAND_MASK) for band in range(BAND_COUNT)]
+
+    def _nearest(self, fingerprint, scope):
+        candidates = set()
+        for key in self._band_keys(fingerprint.hash):
+            candidates |= self._bands.get(key, set())
+        matches = []
+        for entry_id in candidates:
+            known_scope, known, _ = self._entries[entry_id]
+            if known_scope != scope:
+                continue
+            if abs(known.aspect - fingerprint.aspect) > self.aspect_tolerance * max(known.aspect, 1e-6):
+                continue
+            distance = hamming(known.hash, fingerprint.hash)
+            if distance <= self.max_distance:
+                matches.append((distance, entry_id))
+        # Nearest first; the hash alone cannot tell a re-upload from a same-template page
+        for _, entry_id in sorted(matches):
+            if same_content(self._entries[entry_id][1].glyphs, fingerprint.glyphs):
+                return entry_id
+        return None
+
+    def _remove(self, entry_id):
+        _, fingerprint, _ = self._entries.pop(entry_id)
+        for key in self._band_keys(fingerprint.hash):
+            ids = self._bands.get(key)
+            if ids is not None:
+                ids.discard(entry_id)
+                if not ids:
+                    del self._bands[key]
+
+    def lookup(self, fingerprint, scope=None):
+        """Return reusable OCR text for a near-duplicate frame, or None if it should be OCR'd"""
+        with self._lock:
+            entry_id = self._nearest(fingerprint, scope)
+            if entry_id is not None:
+                _, known, text = self._entries[entry_id]
+                if fingerprint.sharpness <= known.sharpness * self.sharper_ratio:
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    return text
+            self.misses += 1
+            return None
+
+    def store(self, fingerprint, text, scope=None):
+        """Remember a frame's OCR text, replacing any near-duplicate it supersedes"""
+        with self._lock:
+            entry_id = self._nearest(fingerprint, scope)
+            if entry_id is not None:
+                self._remove(entry_id)
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, fingerprint, text)
+            for key in self._band_keys(fingerprint.hash):
+                self._bands.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,197 @@
+"""
+InsureScan - Persistent Tesseract OCR pool.
+
+pytesseract.image_to_string starts a new `tesseract` process and reloads the
+eng traineddata for every image. When the optional `tesserocr` bindings are
+installed we instead keep a pool of in-process Tesseract API handles with the
+language model loaded once, recycling each handle after a number of pages or
+after an error. Without tesserocr we fall back to the per-call subprocess.
+
+Benchmark both engines on some sample images:
+    python ocr_pool.py page1.png page2.tiff --repeats 3
+"""
+
+import time
+import queue
+import threading
+
+import pytesseract
+
+try:
+    import tesserocr
+except ImportError:  # Optional dependency: pip install tesserocr
+    tesserocr = None
+
+
+class SubprocessOCR:
+    """Current behaviour: one tesseract process per image"""
+
+    name = 'subprocess'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def stats(self):
+        return {"engine": self.name}
+
+    def close(self):
+        pass
+
+
+class TesseractPool:
+    """
+    Pool of resident tesserocr API handles (model loaded once per handle).
+    Handles are checked out per image, so at most `size` pages are OCR'd at
+    once. A handle is rebuilt after `recycle_after` pages or any error, which
+    keeps long-lived workers healthy if Tesseract leaks or gets into a bad state.
+    """
+
+    name = 'tesserocr'
+    REBUILD_ATTEMPTS = 2
+
+    def __init__(self, size=2, lang='eng', recycle_after=500):
+        self.size = size
+        self.lang = lang
+        self.recycle_after = recycle_after
+        self.recycled = 0
+        self.pages = 0
+        self._lock = threading.Lock()
+        self._handles = queue.Queue()
+        for _ in range(size):
+            self._handles.put(self._new_handle())
+
+    def _new_handle(self):
+        api = tesserocr.PyTessBaseAPI(lang=self.lang)
+        return {"api": api, "uses": 0}
+
+    def _recycle(self, handle):
+        """
+        End a handle and build its replacement. Returns None when no new handle
+        could be built; the pool then shrinks by one.
+        """
+        try:
+            handle["api"].End()
+        except Exception:
+            pass
+        with self._lock:
+            self.recycled += 1
+        error = None
+        for _ in range(self.REBUILD_ATTEMPTS):
+            try:
+                return self._new_handle()
+            except Exception as e:
+                error = e
+        with self._lock:
+            self.size -= 1
+            size = self.size
+        print(f"⚠️ [OCR POOL] Could not rebuild a tesserocr handle ({error}); pool shrinks to {size}")
+        return None
+
+    def _checkout(self):
+        """An idle handle, or None once the pool has shrunk to nothing"""
+        while True:
+            with self._lock:
+                if self.size <= 0:
+                    return None
+            try:
+                return self._handles.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def image_to_string(self, image):
+        if image.mode not in ('1', 'L', 'RGB', 'RGBA'):
+            image = image.convert('RGB')
+        handle = self._checkout()
+        if handle is None:
+            # No handle could be rebuilt: keep OCR working, one process per image
+            return pytesseract.image_to_string(image, lang=self.lang)
+        try:
+            handle["api"].SetImage(image)
+            text = handle["api"].GetUTF8Text()
+            handle["api"].Clear()
+            handle["uses"] += 1
+            with self._lock:
+                self.pages += 1
+            if handle["uses"] >= self.recycle_after:
+                handle = self._recycle(handle)
+            return text
+        except Exception:
+            # Only reached before any recycle: end the failing handle, keep a live replacement
+            handle = self._recycle(handle)
+            raise
+        finally:
+            # A dead handle never goes back; None means the pool shrank
+            if handle is not None:
+                self._handles.put(handle)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "engine": self.name,
+                "size": self.size,
+                "idle": self._handles.qsize(),
+                "pages": self.pages,
+                "recycled": self.recycled,
+            }
+
+    def close(self):
+        while True:
+            try:
+                self._handles.get_nowait()["api"].End()
+            except queue.Empty:
+                break
+
+
+def create_ocr_engine(engine='auto', size=2, lang='eng', recycle_after=500):
+    """Build the configured OCR engine: auto | tesserocr | subprocess"""
+    if engine in ('auto', 'tesserocr') and tesserocr is not None:
+        try:
+            pool = TesseractPool(size=size, lang=lang, recycle_after=recycle_after)
+            print(f"🔠 [OCR POOL] Resident tesserocr pool ready ({size} handles)")
+            return pool
+        except Exception as e:
+            print(f"⚠️ [OCR POOL] Could not start tesserocr pool ({e}), using subprocess OCR")
+    elif engine == 'tesserocr':
+        print(f"⚠️ [OCR POOL] tesserocr not installed, using subprocess OCR")
+    return SubprocessOCR(lang=lang)
+
+
+def benchmark(image_paths, repeats=3, size=2):
+    """Time the per-call subprocess against the resident pool over the given images"""
+    from PIL import Image, ImageSequence
+
+    frames = []
+    for path in image_paths:
+        with Image.open(path) as image:
+            frames.extend(frame.copy() for frame in ImageSequence.Iterator(image))
+    print(f"Benchmarking {len(frames)} frame(s) x {repeats} repeats")
+
+    engines = [SubprocessOCR()]
+    if tesserocr is not None:
+        engines.append(TesseractPool(size=size))
+    else:
+        print("tesserocr not installed - only the subprocess engine will run")
+
+    for engine in engines:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for frame in frames:
+                engine.image_to_string(frame)
+        elapsed = time.perf_counter() - start
+        pages = len(frames) * repeats
+        print(f"{engine.name:>10}: {elapsed:.2f}s total, {1000 * elapsed / pages:.0f} ms/page")
+        engine.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark InsureScan OCR engines")
+    parser.add_argument('images', nargs='+', help="image files to OCR")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--size', type=int, default=2, help="tesserocr pool size")
+    args = parser.parse_args()
+    benchmark(args.images, repeats=args.repeats, size=args.size)
@@ -0,0 +1,483 @@
+"""
+InsureScan - Pluggable PDF text extraction engines.
+
+Every engine opens a PDF and returns the text of one page at a time, so
+iter_pdf_pages can keep its page limit, per-page error handling and
+per-page quality check whatever library does the parsing. Engines that can
+also say where text sits on the page return positioned fragments from
+page_layout(), which table_extract uses to find benefit tables (pdfium and
+pymupdf report exact boxes; PyPDF2/pypdf only text-run start points, and
+runs on one line drawn in a single text object come back merged). PDF_ENGINE picks
+one by name; `auto` takes the first installed engine from AUTO_ORDER
+(PyPDF2 is a hard requirement, so something is always available).
+
+page_images() gives the images to OCR when a page's text layer is bad:
+a rendering of the page (pdfium, pymupdf, poppler's pdftoppm) or the page's
+embedded scan images (PyPDF2/pypdf); pdfminer has neither.
+
+PDFium and MuPDF must not be called from several threads at once, and the
+server runs many gthread threads per worker, so every call into either
+library (open, text, layout, render, close) holds a process-wide lock for
+that library.
+
+    pypdf2    PyPDF2 (the original behaviour)
+    pypdf     pypdf, PyPDF2's maintained successor
+    pdfium    pypdfium2 (PDFium, C++)
+    pymupdf   PyMuPDF / fitz (MuPDF, C)
+    pdfminer  pdfminer.six (slow, layout-aware)
+    poppler   poppler-utils `pdftotext` subprocess
+
+Compare every installed engine on a corpus before choosing:
+    python pdf_engines.py policies/ --max-pages 10
+"""
+
+import io
+import os
+import shutil
+import threading
+import subprocess
+
+from table_extract import Fragment
+
+ENGINES = {}
+
+# Fastest first; used by PDF_ENGINE=auto
+AUTO_ORDER = ['pdfium', 'pymupdf', 'pypdf', 'pypdf2', 'poppler', 'pdfminer']
+
+# One lock per native library that is not thread-safe
+PDFIUM_LOCK = threading.RLock()
+MUPDF_LOCK = threading.RLock()
+
+# Longest side of a rendered page; oversized pages (e.g. scans saved at 72 dpi) are scaled down
+MAX_RENDER_SIDE = 3500
+# Embedded images smaller than this are logos/icons, not the scan of the page
+MIN_SCAN_PIXELS = 200 * 200
+
+
+def register_engine(cls):
+    """Class decorator: make an engine selectable by its name"""
+    ENGINES[cls.name] = cls
+    return cls
+
+
+class PdfEngine:
+    """
+    Base engine. open() returns a document with page_count, page_text(i),
+    page_layout(i) -> (text, fragments or None), page_images(i, dpi) and close().
+    """
+
+    name = None
+
+    @classmethod
+    def available(cls):
+        return False
+
+    def open(self, file_path):
+        raise NotImplementedError
+
+
+class _Document:
+    def __init__(self, page_count, page_text, close=None, page_layout=None, page_images=None, lock=None):
+        self.page_count = page_count
+        self._page_text = page_text
+        self._close = close
+        self._page_layout = page_layout
+        self._page_images = page_images
+        self._lock = lock
+
+    def _call(self, function, *args):
+        if self._lock is None:
+            return function(*args)
+        with self._lock:
+            return function(*args)
+
+    def page_text(self, index):
+        return self._call(self._page_text, index) or ''
+
+    def page_layout(self, index):
+        """Page text plus positioned Fragments, or (text, None) if the engine has no layout"""
+        if self._page_layout is None:
+            return self.page_text(index), None
+        text, fragments = self._call(self._page_layout, index)
+        return text or '', fragments
+
+    def page_images(self, index, dpi=200):
+        """PIL images to OCR for one page (empty if the engine can neither render nor extract them)"""
+        if self._page_images is None:
+            return []
+        return self._call(self._page_images, index, dpi)
+
+    def close(self):
+        if self._close is not None:
+            self._call(self._close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _open_reader(reader_class, file_path):
+    """
+    PyPDF2/pypdf copy a whole file into memory when given a path; handing them
+    an open file instead lets them seek to the objects each page needs.
+    """
+    stream = open(file_path, 'rb')
+    try:
+        reader = reader_class(stream)
+        return _Document(len(reader.pages), lambda i: reader.pages[i].extract_text(), stream.close,
+                         lambda i: _reader_page_layout(reader.pages[i]),
+                         lambda i, dpi: _reader_page_images(reader.pages[i]))
+    except Exception:
+        stream.close()
+        raise
+
+
+def _reader_page_layout(page):
+    """PyPDF2/pypdf: collect text runs with their start point while extracting the text once"""
+    fragments = []
+
+    def visit(text, cm, tm, font_dict, font_size):
+        if not text.strip():
+            return
+        x = tm[4] * cm[0] + tm[5] * cm[2] + cm[4]
+        y = tm[4] * cm[1] + tm[5] * cm[3] + cm[5]
+        size = abs(font_size * tm[3] * cm[3]) or font_size or 10.0
+        fragments.append(Fragment(x, None, y, size, text))
+    text = page.extract_text(visitor_text=visit)
+    return text, fragments
+
+
+def _reader_page_images(page):
+    """PyPDF2/pypdf cannot render; a scanned page is one large embedded image (or a few strips)"""
+    from PIL import Image
+    images = []
+    for embedded in page.images:
+        # Older PyPDF2 releases only expose the encoded bytes
+        image = getattr(embedded, 'image', None) or Image.open(io.BytesIO(embedded.data))
+        if image.width * image.height >= MIN_SCAN_PIXELS:
+            image.load()
+            images.append(image)
+    return images
+
+
+def _render_scale(dpi, width, height):
+    return min(dpi / 72, MAX_RENDER_SIDE / max(width, height, 1))
+
+
+def _importable(module):
+    try:
+        __import__(module)
+        return True
+    except ImportError:
+        return False
+
+
+@register_engine
+class PyPDF2Engine(PdfEngine):
+    name = 'pypdf2'
+
+    @classmethod
+    def available(cls):
+        return _importable('PyPDF2')
+
+    def open(self, file_path):
+        from PyPDF2 import PdfReader
+        return _open_reader(PdfReader, file_path)
+
+
+@register_engine
+class PypdfEngine(PdfEngine):
+    name = 'pypdf'
+
+    @classmethod
+    def available(cls):
+        return _importable('pypdf')
+
+    def open(self, file_path):
+        from pypdf import PdfReader
+        return _open_reader(PdfReader, file_path)
+
+
+@register_engine
+class PdfiumEngine(PdfEngine):
+    name = 'pdfium'
+
+    @classmethod
+    def available(cls):
+        return _importable('pypdfium2')
+
+    def open(self, file_path):
+        import pypdfium2
+        with PDFIUM_LOCK:
+            document = pypdfium2.PdfDocument(file_path)
+
+        def page_layout(index, with_fragments=True):
+            page = document[index]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+                if not with_fragments:
+                    return text, None
+                fragments = []
+                for i in range(textpage.count_rects()):
+                    left, bottom, right, top = textpage.get_rect(i)
+                    piece = textpage.get_text_bounded(left, bottom, right, top)
+                    if piece.strip():
+                        fragments.append(Fragment(left, right, bottom, top - bottom, piece))
+                return text, fragments
+            finally:
+                textpage.close()
+                page.close()
+
+        def page_images(index, dpi):
+            page = document[index]
+            try:
+                return [page.render(scale=_render_scale(dpi, *page.get_size())).to_pil()]
+            finally:
+                page.close()
+        return _Document(len(document), lambda i: page_layout(i, False)[0], document.close, page_layout,
+                         page_images, PDFIUM_LOCK)
+
+
+@register_engine
+class PyMuPDFEngine(PdfEngine):
+    name = 'pymupdf'
+
+    @classmethod
+    def available(cls):
+        return _importable('fitz')
+
+    def open(self, file_path):
+        import fitz
+        with MUPDF_LOCK:
+            document = fitz.open(file_path)
+
+        def page_layout(index):
+            page = document[index]
+            # fitz y grows downwards; negate so higher on the page is larger, like PDF space
+            fragments = [Fragment(x0, x1, -y1, y1 - y0, word)
+                         for x0, y0, x1, y1, word, *_ in page.get_text('words')]
+            return page.get_text(), fragments
+
+        def page_images(index, dpi):
+            from PIL import Image
+            page = document[index]
+            scale = _render_scale(dpi, page.rect.width, page.rect.height)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+            return [Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)]
+        return _Document(document.page_count, lambda i: document[i].get_text(), document.close, page_layout,
+                         page_images, MUPDF_LOCK)
+
+
+@register_engine
+class PdfminerEngine(PdfEngine):
+    name = 'pdfminer'
+
+    @classmethod
+    def available(cls):
+        return _importable('pdfminer')
+
+    def open(self, file_path):
+        from pdfminer.high_level import extract_text
+        from pdfminer.pdfpage import PDFPage
+        with open(file_path, 'rb') as f:
+            page_count = sum(1 for _ in PDFPage.get_pages(f))
+        return _Document(page_count, lambda i: extract_text(file_path, page_numbers=[i]))
+
+
+@register_engine
+class PopplerEngine(PdfEngine):
+    name = 'poppler'
+
+    @classmethod
+    def available(cls):
+        return shutil.which('pdftotext') is not None and shutil.which('pdfinfo') is not None
+
+    def open(self, file_path):
+        info = subprocess.run(['pdfinfo', file_path], capture_output=True, text=True, timeout=30, check=True)
+        page_count = 0
+        page_size = (612.0, 792.0)
+        for line in info.stdout.splitlines():
+            if line.startswith('Pages:'):
+                page_count = int(line.split(':', 1)[1])
+            elif line.startswith('Page size:'):
+                # "Page size:      595.276 x 841.89 pts (A4)" (first page)
+                width, _, height = line.split(':', 1)[1].split()[:3]
+                page_size = (float(width), float(height))
+
+        def page_text(index):
+            page = str(index + 1)
+            result = subprocess.run(['pdftotext', '-q', '-f', page, '-l', page, '-enc', 'UTF-8', file_path, '-'],
+                                    capture_output=True, timeout=60, check=True)
+            return result.stdout.decode('utf-8', errors='replace')
+
+        def page_images(index, dpi):
+            if shutil.which('pdftoppm') is None:
+                return []
+            from PIL import Image
+            page = str(index + 1)
+            resolution = str(max(1, int(72 * _render_scale(dpi, *page_size))))
+            result = subprocess.run(['pdftoppm', '-q', '-f', page, '-l', page, '-r', resolution, '-png', file_path],
+                                    capture_output=True, timeout=120, check=True)
+            return [Image.open(io.BytesIO(result.stdout))]
+        return _Document(page_count, page_text, page_images=page_images)
+
+
+def available_engines():
+    """Names of the engines that can run in this deployment"""
+    return [name for name, cls in ENGINES.items() if cls.available()]
+
+
+def create_pdf_engine(engine='auto'):
+    """Build the configured engine: auto or one of ENGINES (falls back to auto if unavailable)"""
+    if engine != 'auto':
+        cls = ENGINES.get(engine)
+        if cls is not None and cls.available():
+            print(f"📄 [PDF ENGINE] Using {engine}")
+            return cls()
+        print(f"⚠️ [PDF ENGINE] {engine} is not {'installed' if cls else 'a known engine'}, choosing automatically")
+    for name in AUTO_ORDER:
+        cls = ENGINES.get(name)
+        if cls is not None and cls.available():
+            print(f"📄 [PDF ENGINE] Using {name} (auto)")
+            return cls()
+    raise RuntimeError("No PDF extraction engine available; install PyPDF2")
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+
+def _run_engine(name, pdf_paths, max_pages, layout=True):
+    """
+    Runs in a fresh process so each engine's peak memory is measured on its own.
+    With layout, pages go through page_layout (text plus fragments) like the
+    app does with table extraction on; otherwise only page_text is timed.
+    """
+    import time
+    from text_quality import assess_text_quality
+
+    baseline = _peak_rss_mb()
+    engine = ENGINES[name]()
+    pages = failures = passed = 0
+    score_total = 0.0
+    chars = 0
+    fragments = 0
+    start = time.perf_counter()
+    for pdf_path in pdf_paths:
+        try:
+            document = engine.open(pdf_path)
+        except Exception:
+            failures += 1
+            continue
+        with document:
+            for index in range(min(document.page_count, max_pages)):
+                try:
+                    if layout:
+                        text, page_fragments = document.page_layout(index)
+                        fragments += len(page_fragments or ())
+                    else:
+                        text = document.page_text(index)
+                except Exception:
+                    failures += 1
+                    continue
+                quality = assess_text_quality(text)
+                pages += 1
+                chars += len(text)
+                score_total += quality.score
+                passed += quality.ok
+    elapsed = time.perf_counter() - start
+    peak = _peak_rss_mb()
+    return {
+        "engine": name,
+        "layout": layout,
+        "pages": pages,
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "pages_per_sec": round(pages / elapsed, 1) if elapsed else None,
+        "peak_rss_mb": peak,
+        "rss_growth_mb": None if peak is None else round(peak - baseline, 1),
+        "chars": chars,
+        "fragments": fragments,
+        "quality_score": round(score_total / pages, 3) if pages else 0.0,
+        "pages_passing": round(passed / pages, 3) if pages else 0.0,
+    }
+
+
+def compare_engines(pdf_paths, max_pages=10, engines=None, quality_tolerance=0.02, layout=True):
+    """
+    Run every installed engine over pdf_paths and return (results, recommended).
+    `layout` times the page_layout path (see _run_engine).
+    The recommendation is the fastest engine whose mean quality score is
+    within quality_tolerance of the best one.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    names = engines or available_engines()
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(_run_engine, name, pdf_paths, max_pages, layout).result())
+
+    usable = [r for r in results if r["pages"]]
+    if not usable:
+        return results, None
+    best_quality = max(r["quality_score"] for r in usable)
+    candidates = [r for r in usable if r["quality_score"] >= best_quality - quality_tolerance]
+    recommended = max(candidates, key=lambda r: r["pages_per_sec"] or 0)["engine"]
+    return results, recommended
+
+
+def _collect_pdfs(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                found.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith('.pdf'))
+        elif path.lower().endswith('.pdf'):
+            found.append(path)
+    return found
+
+
+if __name__ == '__main__':
+    import json
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare InsureScan PDF extraction engines on a corpus")
+    parser.add_argument('paths', nargs='+', help="PDF files or directories of PDFs")
+    parser.add_argument('--max-pages', type=int, default=10, help="pages per document (matches the app's limit)")
+    parser.add_argument('--engines', nargs='*', help=f"subset of: {', '.join(ENGINES)}")
+    parser.add_argument('--text-only', action='store_true',
+                        help="time page_text only (the app's path with TABLE_EXTRACTION_ENABLED=false)")
+    parser.add_argument('--json', action='store_true', help="print the results as JSON")
+    args = parser.parse_args()
+
+    pdf_paths = _collect_pdfs(args.paths)
+    if not pdf_paths:
+        parser.error("no PDF files found")
+    print(f"Comparing {', '.join(args.engines or available_engines())} on {len(pdf_paths)} PDF(s)")
+    results, recommended = compare_engines(pdf_paths, max_pages=args.max_pages, engines=args.engines,
+                                           layout=not args.text_only)
+
+    if args.json:
+        print(json.dumps({"results": results, "recommended": recommended}, indent=2))
+    else:
+        print(f"{'engine':>9} {'pages':>6} {'fail':>5} {'pages/s':>8} {'peak MB':>8} {'+MB':>6} {'quality':>8} {'passing':>8}")
+        for r in results:
+            peak = '-' if r['peak_rss_mb'] is None else r['peak_rss_mb']
+            growth = '-' if r['rss_growth_mb'] is None else r['rss_growth_mb']
+            print(f"{r['engine']:>9} {r['pages']:>6} {r['failures']:>5} {r['pages_per_sec'] or 0:>8} "
+                  f"{peak:>8} {growth:>6} {r['quality_score']:>8} {r['pages_passing']:>8}")
+        if recommended:
+            print(f"\nRecommended: PDF_ENGINE={recommended}")
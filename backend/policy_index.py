@@ -0,0 +1,186 @@
+"""
+InsureScan - Clause index for follow-up Q&A over an analysed policy.
+
+Each analysed document's extracted text is split into clause-sized chunks
+and kept as a small BM25 inverted index, so a question like "is cataract
+covered?" only needs the top few clauses sent to the AI provider instead of
+re-analysing the whole document.
+"""
+
+import os
+import re
+import json
+import math
+import time
+import heapq
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+CHUNK_TARGET_CHARS = 500
+CHUNK_MIN_CHARS = 120
+
+# Very common words that carry no meaning for clause retrieval
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for',
+    'from', 'has', 'have', 'how', 'i', 'if', 'in', 'is', 'it', 'its', 'my', 'of',
+    'on', 'or', 'our', 'shall', 'that', 'the', 'their', 'there', 'this', 'to',
+    'under', 'was', 'we', 'what', 'when', 'which', 'will', 'with', 'you', 'your',
+    'policy', 'insured', 'insurance',
+}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+_CLAUSE_START_RE = re.compile(r'^\s*(\d+(\.\d+)*[.)]?|[a-z][.)]|\([a-z0-9]+\))\s+\S', re.IGNORECASE)
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed and a light plural strip"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def chunk_text(text, target_chars=CHUNK_TARGET_CHARS, min_chars=CHUNK_MIN_CHARS):
+    """
+    Split extracted policy text into clause-sized chunks.
+    Breaks at blank lines or numbered clause headings once a chunk has
+    min_chars, and always once it reaches target_chars.
+    """
+    chunks = []
+    current = []
+    current_len = 0
+
+    def flush():
+        nonlocal current, current_len
+        chunk = "\n".join(current).strip()
+        if chunk:
+            chunks.append(chunk)
+        current = []
+        current_len = 0
+
+    for line in text.split('\n'):
+        stripped = line.strip()
+        at_boundary = not stripped or _CLAUSE_START_RE.match(stripped)
+        if current_len >= target_chars or (at_boundary and current_len >= min_chars):
+            flush()
+        if stripped:
+            current.append(stripped)
+            current_len += len(stripped) + 1
+    flush()
+    return chunks
+
+
+class BM25Index:
+    """Inverted index over clause chunks with Okapi BM25 scoring"""
+
+    def __init__(self, chunks, k1=1.5, b=0.75):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> [(chunk_idx, term_frequency)]
+        self.lengths = []
+        for idx, chunk in enumerate(chunks):
+            terms = tokenize(chunk)
+            self.lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings.setdefault(term, []).append((idx, tf))
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+
+    def search(self, query, top_k=5):
+        """Return [(chunk_idx, score)] for the top_k clauses matching the query"""
+        total = len(self.chunks)
+        if not total:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for idx, tf in postings:
+                norm = 1 - self.b + self.b * self.lengths[idx] / (self.avg_length or 1)
+                scores[idx] = scores.get(idx, 0.0) + idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+def document_id_for(text):
+    """Stable id for an analysed document, derived from its extracted text"""
+    return hashlib.sha256(text.encode('utf-8', errors='ignore')).hexdigest()[:24]
+
+
+class DocumentIndexStore:
+    """
+    Keeps chunked copies of analysed documents.
+    Chunks are written to disk (so any worker can answer /ask) and built
+    indexes are cached in a small in-process LRU.
+    """
+
+    def __init__(self, folder, max_cached=64, ttl_seconds=24 * 3600):
+        self.folder = folder
+        self.max_cached = max_cached
+        self.ttl_seconds = ttl_seconds
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, document_id):
+        return os.path.join(self.folder, f"{document_id}.json")
+
+    def _remember(self, document_id, index):
+        with self._lock:
+            self._cache[document_id] = index
+            self._cache.move_to_end(document_id)
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+
+    def add(self, text, document_id=None):
+        """Chunk and index a document's extracted text. Returns its document id."""
+        document_id = document_id or document_id_for(text)
+        chunks = chunk_text(text)
+        tmp_path = f"{self._path(document_id)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"created": time.time(), "chunks": chunks}, f)
+        os.replace(tmp_path, self._path(document_id))
+        self._remember(document_id, BM25Index(chunks))
+        self.prune_expired()
+        return document_id
+
+    def get(self, document_id):
+        """Return the BM25Index for a document, or None if unknown/expired"""
+        if not re.fullmatch(r'[0-9a-f]{24}', document_id or ''):
+            return None
+        with self._lock:
+            index = self._cache.get(document_id)
+            if index is not None:
+                self._cache.move_to_end(document_id)
+                return index
+        try:
+            with open(self._path(document_id), encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - stored.get('created', 0) > self.ttl_seconds:
+            return None
+        index = BM25Index(stored.get('chunks', []))
+        self._remember(document_id, index)
+        return index
+
+    def prune_expired(self):
+        """Delete stored chunk files older than the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                if name.endswith('.json') and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
@@ -0,0 +1,159 @@
+"""
+InsureScan - Latency and success aware routing across AI providers/models.
+
+Every attempt against a provider model (e.g. "openrouter:deepseek/deepseek-r1:free",
+"gemini:gemini-2.0-flash-lite") updates rolling EWMA stats: attempt latency,
+error rate and JSON parse-failure rate. Attempts are ordered by expected
+time-to-valid-result (latency / probability of a valid result), with a small
+exploration share so a recovering model gets tried again, and rate-limited
+models are pushed to the back of the queue for a cooldown period.
+"""
+
+import time
+import random
+import threading
+
+OUTCOME_OK = 'ok'
+OUTCOME_ERROR = 'error'
+OUTCOME_PARSE_FAILURE = 'parse_failure'
+OUTCOME_RATE_LIMITED = 'rate_limited'
+
+
+class ModelStats:
+    """Rolling EWMA stats for one provider model"""
+
+    def __init__(self, prior_latency, prior_success):
+        self.latency = prior_latency    # seconds per attempt, any outcome
+        self.success = prior_success    # probability of a valid parsed result
+        self.error_rate = 0.0
+        self.parse_failure_rate = 0.0
+        self.attempts = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_outcome = None
+
+    def update(self, alpha, elapsed, outcome):
+        ok = outcome == OUTCOME_OK
+        # The first real observation replaces the latency prior outright
+        self.latency = elapsed if not self.attempts else self.latency + alpha * (elapsed - self.latency)
+        self.attempts += 1
+        self.success += alpha * ((1.0 if ok else 0.0) - self.success)
+        self.error_rate += alpha * ((1.0 if outcome in (OUTCOME_ERROR, OUTCOME_RATE_LIMITED) else 0.0) - self.error_rate)
+        self.parse_failure_rate += alpha * ((1.0 if outcome == OUTCOME_PARSE_FAILURE else 0.0) - self.parse_failure_rate)
+        self.consecutive_failures = 0 if ok else self.consecutive_failures + 1
+        self.last_outcome = outcome
+
+    def expected_time(self):
+        return self.latency / max(self.success, 0.05)
+
+
+class _Attempt:
+    """One in-flight provider attempt; provider code may flag its outcome"""
+
+    def __init__(self, key):
+        self.key = key
+        self.started = time.monotonic()
+        self.outcome = None
+
+
+class ProviderRouter:
+    def __init__(self, alpha=0.2, explore=0.05, cooldown_seconds=60,
+                 prior_latency=15.0, prior_success=0.6):
+        self.alpha = alpha
+        self.explore = explore
+        self.cooldown_seconds = cooldown_seconds
+        self.prior_latency = prior_latency
+        self.prior_success = prior_success
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _get(self, key):
+        stats = self._stats.get(key)
+        if stats is None:
+            stats = self._stats[key] = ModelStats(self.prior_latency, self.prior_success)
+        return stats
+
+    def order(self, keys):
+        """
+        Order candidate keys by expected time-to-valid-result.
+        Untried models keep their configured order (ties broken by position).
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = sorted(
+                enumerate(keys),
+                key=lambda item: (
+                    self._get(item[1]).cooldown_until > now,
+                    self._get(item[1]).expected_time(),
+                    item[0],
+                )
+            )
+            ready = sum(1 for key in keys if self._get(key).cooldown_until <= now)
+        ordered = [key for _, key in ranked]
+        # Exploration: occasionally try a non-leading model first so its stats stay fresh.
+        # Only models that are not cooling down qualify; a rate-limited one stays at the back.
+        if ready > 1 and random.random() < self.explore:
+            pick = random.randrange(1, ready)
+            ordered.insert(0, ordered.pop(pick))
+        return ordered
+
+    def attempt(self, key):
+        """Start timing an attempt on the current thread. Finish it with finish()."""
+        attempt = _Attempt(key)
+        self._local.attempt = attempt
+        return attempt
+
+    def note(self, outcome):
+        """Flag the outcome of the current thread's attempt (parse failure, rate limited)"""
+        attempt = getattr(self._local, 'attempt', None)
+        if attempt is not None and attempt.outcome is None:
+            attempt.outcome = outcome
+
+    def finish(self, attempt, succeeded):
+        """Record a finished attempt and return (outcome, elapsed seconds)"""
+        self._local.attempt = None
+        elapsed = time.monotonic() - attempt.started
+        outcome = OUTCOME_OK if succeeded else (attempt.outcome or OUTCOME_ERROR)
+        with self._lock:
+            stats = self._get(attempt.key)
+            stats.update(self.alpha, elapsed, outcome)
+            if outcome == OUTCOME_RATE_LIMITED:
+                stats.cooldown_until = time.monotonic() + self.cooldown_seconds
+        return outcome, elapsed
+
+    def circuits(self, keys, failure_threshold=3):
+        """
+        Circuit view per model: 'open' while cooling down after a rate limit or
+        after repeated consecutive failures, else 'closed'.
+        """
+        now = time.monotonic()
+        with self._lock:
+            result = {}
+            for key in keys:
+                stats = self._get(key)
+                is_open = stats.cooldown_until > now or stats.consecutive_failures >= failure_threshold
+                result[key] = {
+                    "circuit": 'open' if is_open else 'closed',
+                    "attempts": stats.attempts,
+                    "consecutive_failures": stats.consecutive_failures,
+                }
+            return result
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                key: {
+                    "attempts": s.attempts,
+                    "latency_ewma_ms": round(s.latency * 1000),
+                    "success_ewma": round(s.success, 3),
+                    "error_rate_ewma": round(s.error_rate, 3),
+                    "parse_failure_rate_ewma": round(s.parse_failure_rate, 3),
+                    "expected_time_to_valid_ms": round(s.expected_time() * 1000),
+                    "consecutive_failures": s.consecutive_failures,
+                    "cooling_down_s": max(0, round(s.cooldown_until - now)),
+                    "last_outcome": s.last_outcome,
+                }
+                for key, s in self._stats.items()
+            }
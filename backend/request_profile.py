@@ -0,0 +1,130 @@
+"""
+InsureScan - Opt-in per-request profiling.
+
+When an admin calls /analyze with profile=1, a RequestProfile is attached
+to the request's context. Stages (save, extraction, section selection,
+provider attempts, indexing) record their time and the bytes/chars they
+handled, and the whole breakdown is returned as a `timings` block.
+The profile lives in a contextvar, so work submitted to thread pools with
+`bind_context` reports into the same request.
+"""
+
+import io
+import time
+import pstats
+import cProfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+_current_profile = contextvars.ContextVar('insurescan_profile', default=None)
+
+
+class RequestProfile:
+    def __init__(self, with_cprofile=False):
+        self.started = time.perf_counter()
+        self.stages = []
+        self.provider_attempts = []
+        self.with_cprofile = with_cprofile
+        self.cprofile_summary = None
+        self._lock = threading.Lock()
+
+    def _ms(self, start):
+        return round((time.perf_counter() - start) * 1000, 1)
+
+    def add_stage(self, name, start, **details):
+        entry = {"stage": name, "start_ms": round((start - self.started) * 1000, 1), "ms": self._ms(start)}
+        entry.update(details)
+        with self._lock:
+            self.stages.append(entry)
+
+    def add_provider_attempt(self, key, outcome, elapsed):
+        with self._lock:
+            self.provider_attempts.append({"model": key, "outcome": outcome, "ms": round(elapsed * 1000, 1)})
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "total_ms": self._ms(self.started),
+                "stages": list(self.stages),
+                "provider_attempts": list(self.provider_attempts),
+            }
+
+
+def start_profile(with_cprofile=False):
+    """Attach a new profile to the current context. Returns (profile, token)."""
+    profile = RequestProfile(with_cprofile=with_cprofile)
+    return profile, _current_profile.set(profile)
+
+
+def stop_profile(token):
+    _current_profile.reset(token)
+
+
+def current_profile():
+    return _current_profile.get()
+
+
+class _StageDetails(dict):
+    """Mutable details a stage can fill in while it runs (chars out, pages...)"""
+
+
+@contextmanager
+def profile_stage(name, **details):
+    """Time a block as a named stage of the current request (no-op when not profiling)"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield _StageDetails()
+        return
+    info = _StageDetails(details)
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        profile.add_stage(name, start, **info)
+
+
+def profiled(name):
+    """Decorator form of profile_stage for text-in/text-out helpers (records chars in/out)"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(text, *args, **kwargs):
+            with profile_stage(name, chars_in=len(text)) as stage:
+                result = fn(text, *args, **kwargs)
+                if isinstance(result, str):
+                    stage['chars_out'] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def cprofile_block():
+    """
+    Run a block under cProfile when the current profile asked for it and
+    store the top functions by cumulative time. Only the calling thread is
+    profiled (tesseract itself runs outside Python).
+    """
+    profile = _current_profile.get()
+    if profile is None or not profile.with_cprofile:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(25)
+        profile.cprofile_summary = out.getvalue()
+
+
+def bind_context(fn):
+    """Wrap fn so it runs in a copy of the caller's context (for executor.submit)"""
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(fn, *args, **kwargs)
+    return run
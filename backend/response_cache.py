@@ -0,0 +1,160 @@
+"""
+InsureScan - Pre-serialized, pre-compressed JSON responses.
+
+Payloads that never change once built (the demo report, a finished
+analysis) are serialized once, compressed once per encoding (gzip, and
+brotli when the optional `brotli` package is installed) and kept in a small
+LRU. Each body carries a strong ETag derived from its bytes, so repeat
+visitors revalidate with If-None-Match and get an empty 304.
+
+`fields=a,b,c` projects the payload to those top-level keys (slim bodies
+for list views); every projection is cached as its own entry.
+"""
+
+import gzip
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # Optional dependency: pip install brotli
+    brotli = None
+
+
+def parse_fields(spec):
+    """'a, b,a' -> ('a', 'b'); None/empty -> None"""
+    if not spec:
+        return None
+    fields = tuple(sorted({field.strip() for field in spec.split(',') if field.strip()}))
+    return fields or None
+
+
+def project(payload, fields):
+    """Keep only the requested top-level keys (unknown ones are ignored)"""
+    if not fields:
+        return payload
+    return {key: payload[key] for key in fields if key in payload}
+
+
+class CachedBody:
+    """One serialized payload with lazily built, then reused, compressed variants"""
+
+    def __init__(self, payload, min_compress_bytes=512):
+        self.identity = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.digest = hashlib.sha256(self.identity).hexdigest()[:32]
+        self.min_compress_bytes = min_compress_bytes
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def etag(self, encoding):
+        # Strong validators must differ per content-coding
+        return f'"{self.digest}"' if encoding == 'identity' else f'"{self.digest}-{encoding}"'
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header names any variant of this body"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        if '*' in tags:
+            return True
+        tags = {tag[2:] if tag.startswith('W/') else tag for tag in tags}
+        return any(self.etag(encoding) in tags for encoding in ('identity', 'gzip', 'br'))
+
+    def body(self, encoding):
+        if encoding == 'identity':
+            return self.identity
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == 'br':
+                    data = brotli.compress(self.identity, quality=11)
+                else:
+                    data = gzip.compress(self.identity, compresslevel=9, mtime=0)
+                self._encoded[encoding] = data
+            return data
+
+    def choose_encoding(self, accept_encoding):
+        if len(self.identity) < self.min_compress_bytes or not accept_encoding:
+            return 'identity'
+        accepted = set()
+        for item in accept_encoding.lower().split(','):
+            coding, _, params = item.partition(';')
+            params = params.replace(' ', '')
+            if params.startswith('q='):
+                try:
+                    if float(params[2:]) <= 0:
+                        continue  # explicitly refused
+                except ValueError:
+                    continue
+            accepted.add(coding.strip())
+        if brotli is not None and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted or '*' in accepted:
+            return 'gzip'
+        return 'identity'
+
+
+class ResponseCache:
+    """Small LRU of CachedBody entries keyed by (name, fields)"""
+
+    def __init__(self, capacity=256, min_compress_bytes=512):
+        self.capacity = capacity
+        self.min_compress_bytes = min_compress_bytes
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build, fields=None):
+        """The cached body for key/fields, calling build() for the full payload on a miss"""
+        cache_key = (key, fields)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry
+        entry = CachedBody(project(build(), fields), self.min_compress_bytes)
+        with self._lock:
+            self.misses += 1
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+        return entry
+
+    def respond(self, key, build, max_age=300):
+        """
+        Flask response for an immutable payload: honours If-None-Match (304
+        on GET/HEAD), Accept-Encoding (br/gzip) and ?fields=.
+        """
+        fields = parse_fields(request.args.get('fields'))
+        entry = self.get(key, build, fields)
+        encoding = entry.choose_encoding(request.headers.get('Accept-Encoding', ''))
+        headers = {
+            'ETag': entry.etag(encoding),
+            'Cache-Control': f'public, max-age={max_age}',
+            'Vary': 'Accept-Encoding',
+        }
+        if request.method in ('GET', 'HEAD') and entry.matches(request.headers.get('If-None-Match')):
+            with self._lock:
+                self.not_modified += 1
+            return Response(status=304, headers=headers)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return Response(entry.body(encoding), mimetype='application/json', headers=headers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "brotli": brotli is not None,
+            }
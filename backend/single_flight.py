@@ -0,0 +1,159 @@
+"""
+InsureScan - Single-flight coalescing of identical in-flight analyses.
+
+When the same document is submitted several times at once (shared link,
+frontend double-submit), only one request runs extract -> LLM; the others
+wait for it and reuse its result if it is shareable (e.g. a real analysis,
+not an error), otherwise they run it themselves.
+
+Within a worker process, duplicates wait on an in-memory flight. Across
+gunicorn workers, the leader holds an exclusive flock on
+<folder>/<key>.lock while computing and then leaves its result in
+<folder>/<key>.json for a short TTL; a worker that finds the lock taken
+waits for it and reads that result. Without fcntl (Windows) only the
+in-process coalescing is active.
+"""
+
+import os
+import json
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: cross-worker coalescing unavailable
+    fcntl = None
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+class SingleFlight:
+    def __init__(self, folder=None, wait_timeout=300, result_ttl=60, shareable=None):
+        self.folder = folder
+        self.wait_timeout = wait_timeout
+        self.result_ttl = result_ttl
+        # Decides which results other requests may reuse (e.g. only successes)
+        self.shareable = shareable or (lambda result: True)
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        if folder and fcntl is not None:
+            os.makedirs(folder, exist_ok=True)
+
+    def run(self, key, compute):
+        """
+        Run compute() once per key at a time. Returns (result, coalesced), where
+        coalesced is True when the result came from another request's run.
+        """
+        if key is None:
+            return compute(), False
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            print(f"🔗 [SINGLE-FLIGHT] Waiting on in-flight analysis {key[:12]}")
+            if flight.event.wait(self.wait_timeout) and not flight.failed and self.shareable(flight.result):
+                self._count()
+                return json.loads(json.dumps(flight.result)), True
+            # Leader failed, took too long or got an unshareable result: do the work ourselves
+            return compute(), False
+
+        try:
+            result, coalesced = self._run_across_workers(key, compute)
+            flight.result = result
+            if coalesced:
+                self._count()
+            return result, coalesced
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            flight.event.set()
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def _count(self):
+        with self._lock:
+            self.coalesced += 1
+
+    def _run_across_workers(self, key, compute):
+        if not self.folder or fcntl is None:
+            return compute(), False
+
+        lock_path = os.path.join(self.folder, f"{key}.lock")
+        result_path = os.path.join(self.folder, f"{key}.json")
+        fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o600)
+        try:
+            if not self._acquire(fd):
+                # Another worker has held the lock too long; don't wait forever
+                return compute(), False
+            cached = self._read_result(result_path)
+            if cached is not None:
+                print(f"🔗 [SINGLE-FLIGHT] Reusing result from another worker for {key[:12]}")
+                return cached, True
+            result = compute()
+            if self.shareable(result):
+                self._write_result(result_path, result)
+            return result, False
+        finally:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+            self._prune()
+
+    def _acquire(self, fd):
+        """Take the exclusive lock, waiting up to wait_timeout if another worker holds it"""
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.2)
+
+    def _read_result(self, result_path):
+        try:
+            if time.time() - os.path.getmtime(result_path) > self.result_ttl:
+                return None
+            with open(result_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_result(self, result_path, result):
+        tmp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, result_path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️ [SINGLE-FLIGHT] Could not store shared result: {e}")
+
+    def _prune(self):
+        """Drop expired result files and stale lock files"""
+        now = time.time()
+        try:
+            names = os.listdir(self.folder)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.folder, name)
+            try:
+                age = now - os.path.getmtime(path)
+                if (name.endswith('.json') and age > self.result_ttl) or \
+                        (name.endswith('.lock') and age > 3600):
+                    os.remove(path)
+            except OSError:
+                continue
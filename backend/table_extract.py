@@ -0,0 +1,227 @@
+"""
+InsureScan - Layout-aware benefit table extraction.
+
+Plain page text flattens benefit tables (room-rent caps, sub-limit
+schedules, co-pay by age band) into jumbled lines. When the PDF engine can
+report where each piece of text sits on the page (see
+pdf_engines.page_layout), fragments are grouped into lines, lines into
+cells by horizontal gaps, and runs of multi-cell lines whose cells line up
+in columns become tables. Tables that look like benefit schedules replace
+their flattened lines in the page text with a compact block:
+
+    === BENEFIT TABLE (page 3) ===
+    Benefit | Limit | Co-payment
+    Room rent | 1% of Sum Insured per day | Nil
+    === END TABLE ===
+
+extract_important_sections keeps these blocks ahead of scored paragraphs.
+"""
+
+import re
+from collections import Counter, namedtuple
+
+# x1 may be None when the engine only reports where a text run starts
+Fragment = namedtuple('Fragment', 'x0 x1 y size text')
+# rows: cell strings per row (wrapped lines joined); cells: every cell as laid out on the page;
+# top/bottom: y of the table's first and last line (PDF space, top >= bottom)
+Table = namedtuple('Table', 'rows cells top bottom')
+
+MIN_ROWS = 3
+MAX_COLUMNS = 8
+COLUMN_TOLERANCE = 15.0         # points between cell starts in the same column
+LINE_TOLERANCE = 2.0            # points a line may sit outside a table's y-range and still belong to it
+MAX_MEDIAN_CELL_CHARS = 45      # longer cells are prose (e.g. two-column layouts)
+
+BENEFIT_TERMS = (
+    'room rent', 'icu', 'sub-limit', 'sublimit', 'limit', 'co-pay', 'copay', 'co-payment',
+    'age', 'sum insured', 'deductible', 'waiting', 'premium', 'benefit', 'per day', 'per claim',
+    'cataract', 'ambulance', 'maternity', 'hospital', '%', 'rs.', 'rupees', '₹', 'inr',
+)
+
+TABLE_BLOCK_PATTERN = re.compile(r'=== BENEFIT TABLE[^\n]*===\n.*?\n=== END TABLE ===', re.S)
+
+
+def _normalize(text):
+    return ' '.join(text.split())
+
+
+def _x1(fragment):
+    if fragment.x1 is not None:
+        return fragment.x1
+    # Rough Helvetica-ish advance width when the engine gives no extent
+    return fragment.x0 + 0.5 * fragment.size * len(fragment.text)
+
+
+def group_lines(fragments):
+    """Fragments -> lines (top to bottom), each a list of fragments left to right"""
+    lines = []
+    for fragment in sorted(fragments, key=lambda f: (-f.y, f.x0)):
+        if lines and abs(lines[-1][0].y - fragment.y) <= max(2.0, 0.5 * fragment.size):
+            lines[-1].append(fragment)
+        else:
+            lines.append([fragment])
+    return [sorted(line, key=lambda f: f.x0) for line in lines]
+
+
+def merge_cells(line, gap_ratio=1.2):
+    """Join fragments separated by less than ~a character width; wider gaps separate cells"""
+    cells = []
+    for fragment in line:
+        text = _normalize(fragment.text)
+        if not text:
+            continue
+        if cells and fragment.x0 - cells[-1][1] <= gap_ratio * max(fragment.size, 1.0):
+            x0, _, previous = cells[-1]
+            cells[-1] = (x0, max(cells[-1][1], _x1(fragment)), f"{previous} {text}")
+        else:
+            cells.append((fragment.x0, _x1(fragment), text))
+    return cells
+
+
+def _column_anchors(rows):
+    starts = sorted(x0 for row in rows for x0, _, _ in row)
+    anchors = []
+    for x0 in starts:
+        if not anchors or x0 - anchors[-1] > COLUMN_TOLERANCE:
+            anchors.append(x0)
+    return anchors
+
+
+def _line_text(line):
+    return ' '.join(fragment.text for fragment in line)
+
+
+def _build_table(run, ys):
+    anchors = _column_anchors(run)
+    if not 2 <= len(anchors) <= MAX_COLUMNS:
+        return None
+    rows = []
+    for line in run:
+        row = [''] * len(anchors)
+        for x0, _, text in line:
+            column = max(i for i, anchor in enumerate(anchors) if anchor <= x0 + COLUMN_TOLERANCE)
+            row[column] = f"{row[column]} {text}".strip()
+        # A row with an empty first column continues the wrapped cells above it
+        if rows and not row[0]:
+            rows[-1] = [f"{above} {below}".strip() for above, below in zip(rows[-1], row)]
+        else:
+            rows.append(row)
+    if len(rows) < MIN_ROWS:
+        return None
+    lengths = sorted(len(cell) for row in rows for cell in row if cell)
+    if lengths[len(lengths) // 2] > MAX_MEDIAN_CELL_CHARS:
+        return None
+    return Table(rows, {text for line in run for _, _, text in line}, ys[0], ys[-1])
+
+
+def find_tables(fragments):
+    """Tables on a page (see Table)"""
+    tables = []
+    run = []
+    ys = []
+    first_column = None
+    for line in group_lines(fragments):
+        cells = merge_cells(line)
+        if len(cells) >= 2:
+            if not run:
+                first_column = cells[0][0]
+            run.append(cells)
+            ys.append(line[0].y)
+            continue
+        # A lone cell right of the first column inside a table is a wrapped cell
+        if run and len(cells) == 1 and cells[0][0] > first_column + COLUMN_TOLERANCE:
+            run.append(cells)
+            ys.append(line[0].y)
+            continue
+        if len(run) >= MIN_ROWS:
+            table = _build_table(run, ys)
+            if table:
+                tables.append(table)
+        run = []
+        ys = []
+    if len(run) >= MIN_ROWS:
+        table = _build_table(run, ys)
+        if table:
+            tables.append(table)
+    return tables
+
+
+def is_benefit_table(table):
+    """Numbers in a good share of rows and at least one benefit-schedule term"""
+    rows = table.rows
+    text = ' '.join(' '.join(row) for row in rows).lower()
+    if not any(term in text for term in BENEFIT_TERMS):
+        return False
+    body = rows[1:] if not any(ch.isdigit() for ch in ''.join(rows[0])) else rows
+    numeric_rows = sum(1 for row in body if any(ch.isdigit() for ch in ''.join(row)))
+    return numeric_rows * 3 >= len(body)
+
+
+def render_table(rows, page_number):
+    lines = [f"=== BENEFIT TABLE (page {page_number}) ==="]
+    lines.extend(' | '.join(cell or '-' for cell in row) for row in rows)
+    lines.append("=== END TABLE ===")
+    return '\n'.join(lines)
+
+
+def _key(text):
+    return re.sub(r'\s+', '', text)
+
+
+def _line_covered(line, cells):
+    """True if a text line is made up entirely of table cell strings"""
+    remaining = _normalize(line)
+    if not remaining:
+        return False
+    for cell in cells:
+        if cell in remaining:
+            remaining = remaining.replace(cell, ' ')
+    return not re.sub(r'[\s|:.,;-]+', '', remaining)
+
+
+def extract_benefit_tables(page_text, fragments, page_number):
+    """
+    Replace the flattened lines of benefit tables in page_text with compact
+    table blocks. Returns (text, number of tables).
+    Text lines carry no positions, so a line made of cell strings is kept
+    when the layout has a line with the same text outside every table's
+    y-range (a heading or prose line that repeats a cell), once per such line.
+    """
+    if not fragments:
+        return page_text, 0
+    tables = [table for table in find_tables(fragments) if is_benefit_table(table)]
+    if not tables:
+        return page_text, 0
+
+    blocks = '\n'.join(render_table(table.rows, page_number) for table in tables)
+    cells = sorted(set().union(*(table.cells for table in tables)), key=len, reverse=True)
+    outside = Counter(
+        _key(_line_text(line)) for line in group_lines(fragments)
+        if not any(table.bottom - LINE_TOLERANCE <= line[0].y <= table.top + LINE_TOLERANCE for table in tables)
+    )
+    kept = []
+    inserted = False
+    for line in page_text.split('\n'):
+        if _line_covered(line, cells):
+            key = _key(line)
+            if outside[key] > 0:
+                # Same text sits outside the tables: that is the copy this line is
+                outside[key] -= 1
+                kept.append(line)
+                continue
+            if not inserted:
+                kept.append(blocks)
+                inserted = True
+            continue
+        kept.append(line)
+    if not inserted:
+        kept.append(blocks)
+    return '\n'.join(kept), len(tables)
+
+
+def split_table_blocks(text):
+    """(table blocks, text without them)"""
+    blocks = TABLE_BLOCK_PATTERN.findall(text)
+    if not blocks:
+        return [], text
+    return blocks, TABLE_BLOCK_PATTERN.sub('', text)
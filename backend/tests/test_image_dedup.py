@@ -0,0 +1,95 @@
+import io
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+from image_dedup import Fingerprint, PerceptualOCRCache, hamming
+
+
+def schedule_page(name, policy_number, sum_insured):
+    """A policy-schedule page printed from one insurer template"""
+    image = Image.new('RGB', (1240, 1754), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((60, 60, 1180, 200), fill=(20, 60, 140))
+    draw.text((90, 100), 'ACME HEALTH INSURANCE CO. LTD', font=ImageFont.load_default(44), fill='white')
+    rows = [
+        ('Policyholder', name), ('Policy Number', policy_number), ('Sum Insured', sum_insured),
+        ('Plan', 'Family Floater Gold'), ('Room Rent', '1% of SI per day'), ('Co-payment', '10% above age 60'),
+    ]
+    font = ImageFont.load_default(28)
+    for i, (label, value) in enumerate(rows):
+        top = 360 + i * 70
+        draw.rectangle((80, top, 1160, top + 70), outline='black')
+        draw.text((100, top + 18), label, font=font, fill='black')
+        draw.text((540, top + 18), value, font=font, fill='black')
+    for i in range(20):
+        draw.text((90, 900 + i * 36), f'Terms and conditions apply as per clause {i + 1}.',
+                  font=ImageFont.load_default(22), fill='black')
+    return image
+
+
+def reencoded(image, quality=70):
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')
+
+
+def shifted(image, dx, dy):
+    moved = Image.new('RGB', image.size, 'white')
+    moved.paste(image, (dx, dy))
+    return moved
+
+
+def test_same_template_pages_with_different_details_do_not_match():
+    first = Fingerprint(schedule_page('Rahul Sharma', 'P/2024/118233', 'Rs. 5,00,000'))
+    second = Fingerprint(schedule_page('Priya Iyer', 'P/2024/907114', 'Rs. 10,00,000'))
+    one_digit = Fingerprint(schedule_page('Rahul Sharma', 'P/2024/118234', 'Rs. 5,00,000'))
+    other_sum = Fingerprint(schedule_page('Rahul Sharma', 'P/2024/118233', 'Rs. 6,00,000'))
+    cache = PerceptualOCRCache()
+    cache.store(first, 'Policyholder Rahul Sharma', scope='ip:203.0.113.7')
+
+    # The hash alone would call these duplicates
+    assert hamming(first.hash, second.hash) <= cache.max_distance
+    assert cache.lookup(second, scope='ip:203.0.113.7') is None
+    assert cache.lookup(one_digit, scope='ip:203.0.113.7') is None
+    assert cache.lookup(other_sum, scope='ip:203.0.113.7') is None
+
+
+def test_reupload_reuses_text_only_within_its_scope():
+    page = schedule_page('Rahul Sharma', 'P/2024/118233', 'Rs. 5,00,000')
+    cache = PerceptualOCRCache()
+    cache.store(Fingerprint(page), 'Policyholder Rahul Sharma', scope='ip:203.0.113.7')
+
+    again = Fingerprint(reencoded(page))
+    assert cache.lookup(again, scope='ip:198.51.100.2') is None
+    assert cache.lookup(again, scope='ip:203.0.113.7') == 'Policyholder Rahul Sharma'
+
+
+def test_shifted_copy_is_aligned_before_comparing():
+    page = schedule_page('Rahul Sharma', 'P/2024/118233', 'Rs. 5,00,000')
+    cache = PerceptualOCRCache()
+    cache.store(Fingerprint(page), 'Policyholder Rahul Sharma')
+
+    assert cache.lookup(Fingerprint(reencoded(shifted(page, 3, 3)))) == 'Policyholder Rahul Sharma'
+    assert cache.lookup(Fingerprint(reencoded(shifted(page, 40, -25)))) == 'Policyholder Rahul Sharma'
+
+
+def test_blurred_reshot_is_ocrd_again():
+    page = schedule_page('Rahul Sharma', 'P/2024/118233', 'Rs. 5,00,000')
+    cache = PerceptualOCRCache()
+    cache.store(Fingerprint(page), 'Policyholder Rahul Sharma')
+
+    # Blur moves as many glyph pixels as a changed digit; not treated as the same image
+    assert cache.lookup(Fingerprint(reencoded(page.filter(ImageFilter.GaussianBlur(1))))) is None
+
+
+def test_sharper_copy_replaces_a_dim_upload():
+    page = schedule_page('Rahul Sharma', 'P/2024/118233', 'Rs. 5,00,000')
+    dim = Fingerprint(reencoded(page.point(lambda v: int(v * 0.5 + 90))))
+    cache = PerceptualOCRCache()
+    cache.store(dim, 'Po1icyho1der Rahu1 Sharma')
+
+    sharp = Fingerprint(page)
+    assert cache.lookup(sharp) is None
+    cache.store(sharp, 'Policyholder Rahul Sharma')
+    assert cache.stats()["entries"] == 1
+    assert cache.lookup(dim) == 'Policyholder Rahul Sharma'
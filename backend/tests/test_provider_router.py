@@ -0,0 +1,24 @@
+from provider_router import OUTCOME_RATE_LIMITED, ProviderRouter
+
+
+def rate_limit(router, key):
+    attempt = router.attempt(key)
+    router.note(OUTCOME_RATE_LIMITED)
+    router.finish(attempt, False)
+
+
+def test_exploration_never_leads_with_a_cooling_down_model():
+    router = ProviderRouter(explore=1.0)
+    rate_limit(router, 'gemini:gemini-2.0-flash-lite')
+    keys = ['openrouter:deepseek/deepseek-r1:free', 'gemini:gemini-2.0-flash-lite', 'openrouter:qwen/qwen-2.5-72b:free']
+
+    for _ in range(200):
+        assert router.order(keys)[-1] == 'gemini:gemini-2.0-flash-lite'
+
+
+def test_no_exploration_when_only_one_model_is_ready():
+    router = ProviderRouter(explore=1.0)
+    rate_limit(router, 'gemini:gemini-2.0-flash-lite')
+    keys = ['openrouter:deepseek/deepseek-r1:free', 'gemini:gemini-2.0-flash-lite']
+
+    assert router.order(keys) == keys
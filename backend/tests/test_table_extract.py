@@ -0,0 +1,83 @@
+from table_extract import Fragment, extract_benefit_tables, find_tables
+
+# Columns of a three-column benefit schedule, in points
+BENEFIT, LIMIT, COPAY = 60.0, 220.0, 420.0
+
+
+def cell(x0, y, text, size=10.0):
+    return Fragment(x0, x0 + 0.5 * size * len(text), y, size, text)
+
+
+def benefit_schedule(top=700.0):
+    """Fragments and flattened page text of a schedule whose 'Room rent' limit wraps onto a second line"""
+    lines = [
+        [(BENEFIT, 'Benefit'), (LIMIT, 'Limit'), (COPAY, 'Co-payment')],
+        [(BENEFIT, 'Room rent'), (LIMIT, '1% of Sum Insured'), (COPAY, 'Nil')],
+        [(LIMIT, 'per day')],
+        [(BENEFIT, 'ICU'), (LIMIT, '2% of Sum Insured per day'), (COPAY, 'Nil')],
+        [(BENEFIT, 'Cataract'), (LIMIT, 'Rs. 40,000 per eye'), (COPAY, '10%')],
+    ]
+    fragments = [cell(x0, top - 14 * row, text) for row, line in enumerate(lines) for x0, text in line]
+    text = [' '.join(text for _, text in line) for line in lines]
+    return fragments, text
+
+
+def test_wrapped_cell_joins_the_row_above():
+    fragments, _ = benefit_schedule()
+
+    [table] = find_tables(fragments)
+    assert table.rows == [
+        ['Benefit', 'Limit', 'Co-payment'],
+        ['Room rent', '1% of Sum Insured per day', 'Nil'],
+        ['ICU', '2% of Sum Insured per day', 'Nil'],
+        ['Cataract', 'Rs. 40,000 per eye', '10%'],
+    ]
+    assert (table.top, table.bottom) == (700.0, 644.0)
+
+
+def test_two_column_prose_is_not_a_table():
+    left = [
+        'The insurer will pay for in-patient treatment taken',
+        'in a network hospital on a cashless basis, subject',
+        'to the room rent limits and sub-limits in Section 4.',
+        'Claims must be notified within 48 hours of admission.',
+    ]
+    right = [
+        'Pre-existing diseases are covered after a waiting',
+        'period of 36 months of continuous coverage with us,',
+        'provided the policy has been renewed without a break.',
+        'Maternity benefits apply after a 24 month wait period.',
+    ]
+    fragments = [cell(50.0, 700.0 - 14 * i, text, size=8.0) for i, text in enumerate(left)]
+    fragments += [cell(320.0, 700.0 - 14 * i, text, size=8.0) for i, text in enumerate(right)]
+
+    assert find_tables(fragments) == []
+
+
+def test_heading_above_the_table_stays_in_the_text():
+    fragments, table_lines = benefit_schedule(top=700.0)
+    fragments.append(cell(BENEFIT, 730.0, 'Schedule of Benefits', size=14.0))
+    page_text = '\n'.join(['Schedule of Benefits'] + table_lines)
+
+    text, count = extract_benefit_tables(page_text, fragments, 3)
+
+    assert count == 1
+    assert text.split('\n')[:2] == ['Schedule of Benefits', '=== BENEFIT TABLE (page 3) ===']
+    assert 'Room rent | 1% of Sum Insured per day | Nil' in text
+    assert 'Room rent 1% of Sum Insured Nil' not in text
+
+
+def test_prose_repeating_a_cell_outside_the_table_is_kept():
+    fragments, table_lines = benefit_schedule(top=700.0)
+    # A section heading and a prose line further down the page reuse cell strings
+    fragments.append(cell(BENEFIT, 500.0, 'Room rent', size=12.0))
+    fragments.append(cell(BENEFIT, 480.0, 'Nil'))
+    page_text = '\n'.join(table_lines + ['Room rent', 'Nil', 'Room rent is payable up to the limit above.'])
+    fragments.append(cell(BENEFIT, 466.0, 'Room rent is payable up to the limit above.'))
+
+    text, count = extract_benefit_tables(page_text, fragments, 3)
+
+    assert count == 1
+    lines = text.split('\n')
+    assert lines[-3:] == ['Room rent', 'Nil', 'Room rent is payable up to the limit above.']
+    assert 'per day' not in lines
@@ -0,0 +1,48 @@
+from text_quality import assess_text_quality
+
+PROSE_PAGE = """
+Section 4. Exclusions. The insurer shall not be liable to make any payment under this policy
+in respect of any expenses incurred for treatment of any pre-existing disease until 48 months
+of continuous coverage have elapsed since the inception of the first policy with the company.
+Expenses for cosmetic surgery, dental treatment and spectacles are excluded unless they are
+required for the treatment of an injury sustained in an accident during the policy period.
+"""
+
+PREMIUM_TABLE_PAGE = """
+Premium Table (Annual, excluding GST)
+Age Band Sum Insured Premium Sum Insured Premium
+18-35 Rs. 5,00,000 Rs. 8,000 Rs. 10,00,000 Rs. 12,500
+36-45 Rs. 5,00,000 Rs. 11,200 Rs. 10,00,000 Rs. 16,800
+46-55 Rs. 5,00,000 Rs. 17,400 Rs. 10,00,000 Rs. 25,000
+56-60 Rs. 5,00,000 Rs. 24,000 Rs. 10,00,000 Rs. 33,000
+61-65 Rs. 5,00,000 Rs. 31,000 Rs. 10,00,000 Rs. 44,000
+"""
+
+# Duplicated glyphs from a broken font mapping, with fragments of symbol soup
+GARBLED_PAGE = """
+SSSSEEEECCCCTTTTIIIIOOOONNNN 4444 EEEEXXXXCCCCLLLLUUUUSSSSIIIIOOOONNNNSSSS
+TTTThhhheeee iiiinnnnssssuuuurrrreeeerrrr sssshhhhaaaallllllll nnnnooootttt
+bbbbeeee lllliiiiaaaabbbblllleeee ttttoooo mmmmaaaakkkkeeee aaaannnnyyyy
+ppppaaaayyyymmmmeeeennnntttt ¤¶§ ÞÐ¦ ¬¤¶ ±§Þ ÐÞ¦ ¤¬±
+"""
+
+
+def test_prose_page_passes():
+    quality = assess_text_quality(PROSE_PAGE)
+    assert quality.ok, quality.reasons
+
+
+def test_premium_table_passes():
+    quality = assess_text_quality(PREMIUM_TABLE_PAGE)
+    assert quality.ok, quality.reasons
+    assert quality.repeat_ratio == 0
+
+
+def test_garbled_page_fails():
+    quality = assess_text_quality(GARBLED_PAGE)
+    assert not quality.ok
+    assert 'repeated_glyphs' in quality.reasons
+
+
+def test_empty_page_is_too_little_text():
+    assert assess_text_quality('  \n ').reasons == ['too_little_text']
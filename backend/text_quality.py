@@ -0,0 +1,143 @@
+"""
+InsureScan - Text-layer quality scoring for PDF pages.
+
+Some PDFs carry a broken text layer (duplicated glyphs like 'SSSSBBBBIIIII',
+unmapped fonts that extract as symbol soup) and mixed documents often have a
+few scanned pages with no text at all. Each page's extracted text is scored
+on three signals so only the bad pages need to be OCR'd:
+
+- character entropy: natural-language text sits in a narrow band; repeated
+  glyphs fall below it, random symbol soup rises above it
+- dictionary-word ratio: share of word tokens that are common English or
+  insurance words; tokens with digits are left out, and pages that are
+  mostly numbers (premium tables, benefit schedules) are not judged on it
+- repeated-glyph ratio: share of characters inside runs of 3+ identical
+  letters (digit runs like the 000 groups in 5,00,000 are normal)
+"""
+
+import re
+import math
+from collections import Counter
+
+MIN_CHARS = 40                  # fewer non-space characters: treat as a scanned page
+MIN_ENTROPY = 3.0               # bits per character
+MAX_ENTROPY = 5.6
+MIN_WORD_RATIO = 0.2
+MIN_WORDS_FOR_RATIO = 8         # too few word tokens to judge the ratio
+MAX_NUMERIC_TOKEN_SHARE = 0.5   # above this share of digit tokens the ratio is not judged
+MAX_REPEAT_RATIO = 0.15
+
+COMMON_WORDS = frozenset("""
+a about above after against all also an and any are as at be been before being below between both but by
+can could did do does done during each either else every for from further had has have having he her here
+him his how i if in into is it its itself may me more most must my no nor not of off on once only or other
+our out over own per same shall she should so some such than that the their them then there these they this
+those through to too under until up upon us was we were what when where whether which while who whom whose
+why will with within without would you your
+policy insured insurer insurance sum premium claim claims cover covered coverage benefit benefits hospital
+hospitalization hospitalisation treatment expenses expense amount limit limits period waiting days day year
+years month months date payable paid pay deductible copay co-payment exclusion exclusions excluded condition
+conditions disease illness injury accident medical surgery room rent charges room-rent bonus renewal plan
+member members family person persons section clause schedule certificate terms details name number total
+annual maximum minimum applicable subject provided including include includes following case under table
+life health company customer proposer nominee document documents opd icu ambulance pre-existing cashless
+network daycare maternity newborn critical coverages reimbursement rs inr gst age band
+""".split())
+
+_TOKEN_STRIP = '.,;:!?()[]{}"\'`*-/\\|<>'
+_REPEAT_RUN = re.compile(r'([^\W\d_])\1{2,}')
+
+
+class TextQuality:
+    """Quality verdict for one page of extracted text"""
+
+    def __init__(self, chars, entropy, word_ratio, repeat_ratio, reasons):
+        self.chars = chars
+        self.entropy = entropy
+        self.word_ratio = word_ratio
+        self.repeat_ratio = repeat_ratio
+        self.reasons = reasons
+
+    @property
+    def ok(self):
+        return not self.reasons
+
+    @property
+    def score(self):
+        """0..1, higher is better; used to pick between text layer and OCR output"""
+        if self.chars < MIN_CHARS:
+            return 0.0
+        word_part = 1.0 if self.word_ratio is None else min(1.0, self.word_ratio / 0.5)
+        entropy_part = 1.0 if MIN_ENTROPY <= self.entropy <= MAX_ENTROPY else 0.5
+        return round(word_part * entropy_part * (1.0 - self.repeat_ratio), 3)
+
+    def to_dict(self):
+        return {
+            "chars": self.chars,
+            "entropy": round(self.entropy, 2),
+            "word_ratio": None if self.word_ratio is None else round(self.word_ratio, 2),
+            "repeat_ratio": round(self.repeat_ratio, 2),
+            "score": self.score,
+            "reasons": self.reasons,
+        }
+
+
+def char_entropy(text):
+    """Shannon entropy (bits per character) of the non-whitespace characters"""
+    counts = Counter(ch for ch in text if not ch.isspace())
+    total = sum(counts.values())
+    if not total:
+        return 0.0
+    return -sum(n / total * math.log2(n / total) for n in counts.values())
+
+
+def dictionary_word_ratio(text):
+    """
+    Share of word tokens found in COMMON_WORDS, or None when there are too
+    few words to judge or the page is mostly numbers
+    """
+    words = []
+    numeric = 0
+    for token in text.split():
+        token = token.strip(_TOKEN_STRIP).lower()
+        if not token:
+            continue
+        if any(ch.isdigit() for ch in token):
+            numeric += 1
+        else:
+            words.append(token)
+    if len(words) < MIN_WORDS_FOR_RATIO or numeric > MAX_NUMERIC_TOKEN_SHARE * (numeric + len(words)):
+        return None
+    return sum(word in COMMON_WORDS for word in words) / len(words)
+
+
+def repeated_glyph_ratio(text):
+    """Share of non-space characters that sit in runs of 3+ identical letters"""
+    total = sum(1 for ch in text if not ch.isspace())
+    if not total:
+        return 0.0
+    repeated = sum(len(match.group(0)) for match in _REPEAT_RUN.finditer(text))
+    return repeated / total
+
+
+def assess_text_quality(text):
+    """Score a page's extracted text. TextQuality.ok is False when it should be OCR'd."""
+    text = text or ''
+    chars = sum(1 for ch in text if not ch.isspace())
+    entropy = char_entropy(text)
+    word_ratio = dictionary_word_ratio(text)
+    repeat_ratio = repeated_glyph_ratio(text)
+
+    reasons = []
+    if chars < MIN_CHARS:
+        reasons.append('too_little_text')
+    else:
+        if entropy < MIN_ENTROPY:
+            reasons.append('low_entropy')
+        elif entropy > MAX_ENTROPY:
+            reasons.append('high_entropy')
+        if word_ratio is not None and word_ratio < MIN_WORD_RATIO:
+            reasons.append('few_dictionary_words')
+        if repeat_ratio > MAX_REPEAT_RATIO:
+            reasons.append('repeated_glyphs')
+    return TextQuality(chars, entropy, word_ratio, repeat_ratio, reasons)